@@ -0,0 +1,221 @@
+###
+# Benchmark:
+#       Makes synthetic test clips (nothing to download, same clips every time)
+#           static - a still picture
+#           motion - a scrolling picture with moving boxes
+#           bw - black and white shapes moving around (like bad apple)
+#           noisy - a still picture with new noise on every frame
+#       at a few resolutions
+#       Encodes every clip with every posterization (vidToDna)
+#       Decodes every strand with every mutation (decodeDNA)
+#       Reports frames/sec, bases/sec, bases per pixel, compression ratio (source size / strand size)
+#       and peak memory (every run happens in a fresh process, so the peak is the run's own)
+#       Writes everything out as JSON to compare between versions
+#
+#       python benchmark.py                      - everything, results in benchmark-results.json
+#       python benchmark.py --quick              - small clips, fewer posterizations and mutations
+#       python benchmark.py --output before.json --resolutions 320x240 --mutations none rip
+###
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from decoding import decodeDNA, mutations
+from encoding import vidToDna
+from strand import indexPath, openStrand
+
+
+clipKinds = ['static', 'motion', 'bw', 'noisy']
+posterizations = ['high', 'med', 'low', 'none']
+
+
+# Synthetic clips
+# a smooth color picture with some edges, the starting point of most clips
+def testPicture(width, height, rng):
+    y, x = np.mgrid[0:height, 0:width]
+    picture = np.empty((height, width, 3), dtype=np.uint8)
+    picture[:, :, 0] = (x * 255 // max(width - 1, 1)).astype(np.uint8)
+    picture[:, :, 1] = (y * 255 // max(height - 1, 1)).astype(np.uint8)
+    picture[:, :, 2] = ((x + y) % 64 * 4).astype(np.uint8)
+    for k in range(8):
+        left, top = rng.integers(0, width), rng.integers(0, height)
+        picture[top:top + height // 6, left:left + width // 6] = rng.integers(0, 256, 3)
+    return picture
+
+
+def clipFrames(kind, width, height, frameCount, rng):
+    picture = testPicture(width, height, rng)
+    y, x = np.mgrid[0:height, 0:width]
+    for k in range(frameCount):
+        if kind == 'static':
+            yield picture
+        elif kind == 'motion':
+            frame = np.roll(picture, 4 * k, axis=1)
+            for box in range(4):
+                left = (box * width // 4 + 7 * k) % width
+                top = (box * height // 4 + 3 * k) % height
+                frame[top:top + height // 8, left:left + width // 8] = 255 - 60 * box
+            yield frame
+        elif kind == 'bw':
+            frame = np.zeros((height, width, 3), dtype=np.uint8)
+            for blob in range(3):
+                centerX = width / 2 + width / 3 * np.cos(k / 15 + 2 * blob)
+                centerY = height / 2 + height / 3 * np.sin(k / 10 + 2 * blob)
+                frame[(x - centerX) ** 2 + (y - centerY) ** 2 < (min(width, height) / 6) ** 2] = 255
+            yield frame
+        else: # noisy
+            noise = rng.integers(-20, 21, picture.shape)
+            yield np.clip(picture + noise, 0, 255).astype(np.uint8)
+
+
+# clips are saved losslessly (FFV1) so a static clip stays exactly static
+def makeClip(path, kind, width, height, frameCount, fps, seed):
+    rng = np.random.default_rng(seed)
+    vid = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'FFV1'), fps, (width, height))
+    for frame in clipFrames(kind, width, height, frameCount, rng):
+        vid.write(frame)
+    vid.release()
+    return path
+
+
+# Runs (each one in its own process)
+def peakRssMB():
+    # kilobytes on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == 'Darwin' else peak / 1024
+
+
+def strandBases(path):
+    with openStrand(path) as strand:
+        return len(strand)
+
+
+def runEncode(clipPath, posterization, outputDir, options):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        strandPath = vidToDna(clipPath, posterization, outputDir=outputDir, **options)
+        seconds = time.perf_counter() - start
+    return strandPath, seconds, peakRssMB()
+
+
+def runDecode(strandPath, outputPath, mutation, seed, workers):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        decodeDNA(strandPath, outputPath, mutation, workers=workers, seed=seed)
+        seconds = time.perf_counter() - start
+    return seconds, peakRssMB()
+
+
+def inFreshProcess(function, *args):
+    with ProcessPoolExecutor(1, max_tasks_per_child=1) as pool:
+        return pool.submit(function, *args).result()
+
+
+def benchmark(resolutions, frameCount, fps, kinds, posterizationList, mutationList, workDir,
+              options, seed=0, decodeWorkers=1):
+    os.makedirs(workDir, exist_ok=True)
+    results = []
+    for width, height in resolutions:
+        for kind in kinds:
+            clipPath = makeClip(f'{workDir}/{kind}_{width}x{height}.avi', kind, width, height, frameCount, fps, seed)
+            sourceBytes = os.path.getsize(clipPath)
+            pixels = width * height * frameCount
+            for posterization in posterizationList:
+                strandPath, seconds, peak = inFreshProcess(runEncode, clipPath, posterization, workDir, options)
+                bases = strandBases(strandPath)
+                strandBytes = os.path.getsize(strandPath)
+                result = {
+                    'clip': kind, 'width': width, 'height': height, 'frames': frameCount,
+                    'posterization': posterization, 'sourceBytes': sourceBytes,
+                    'encode': {
+                        'seconds': seconds,
+                        'framesPerSec': frameCount / seconds,
+                        'basesPerSec': bases / seconds,
+                        'bases': bases,
+                        'basesPerPixel': bases / pixels,
+                        'strandBytes': strandBytes,
+                        'compressionRatio': sourceBytes / strandBytes,
+                        'peakRssMB': peak,
+                    },
+                    'decode': {},
+                }
+                for mutation in mutationList:
+                    outputPath = f'{workDir}/{kind}_{width}x{height}_{posterization}_{mutation}'
+                    seconds, peak = inFreshProcess(runDecode, strandPath, outputPath, mutation, seed, decodeWorkers)
+                    result['decode'][mutation] = {
+                        'seconds': seconds,
+                        'framesPerSec': frameCount / seconds,
+                        'basesPerSec': bases / seconds,
+                        'peakRssMB': peak,
+                    }
+                    os.remove(outputPath + '.avi')
+                os.remove(strandPath)
+                if os.path.exists(indexPath(strandPath)):
+                    os.remove(indexPath(strandPath))
+                results.append(result)
+                print(f"{kind} {width}x{height} {posterization}: encode {result['encode']['framesPerSec']:.1f} fps, "
+                      f"{result['encode']['basesPerPixel']:.2f} bases/pixel")
+    return results
+
+
+def parseResolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encode/decode benchmark on synthetic clips')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--work-dir', default='benchmark-work')
+    parser.add_argument('--quick', action='store_true', help='small clips, high/none only, no mutations but none')
+    parser.add_argument('--resolutions', nargs='+', type=parseResolution, default=[(160, 120), (320, 240), (640, 360)])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--clips', nargs='+', choices=clipKinds, default=clipKinds)
+    parser.add_argument('--posterizations', nargs='+', choices=posterizations, default=posterizations)
+    parser.add_argument('--mutations', nargs='+', choices=list(mutations), default=list(mutations))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--packed', action='store_true')
+    parser.add_argument('--long-runs', action='store_true')
+    parser.add_argument('--keyframe-interval', type=int, default=0)
+    parser.add_argument('--tile-size', type=int, default=0, help='format version 3 tiles (0 = no tiles)')
+    parser.add_argument('--entropy', action='store_true', help='format version 4 color codes')
+    parser.add_argument('--encode-workers', type=int, default=1)
+    parser.add_argument('--decode-workers', type=int, default=1)
+    args = parser.parse_args()
+    if args.quick:
+        args.resolutions, args.frames = [(160, 120)], 30
+        args.posterizations, args.mutations = ['high', 'none'], ['none']
+
+    options = {'packed': args.packed, 'longRuns': args.long_runs,
+               'keyframeInterval': args.keyframe_interval, 'tileSize': args.tile_size, 'entropy': args.entropy,
+               'workers': args.encode_workers}
+    results = benchmark(args.resolutions, args.frames, args.fps, args.clips, args.posterizations, args.mutations,
+                        args.work_dir, options, args.seed, args.decode_workers)
+    report = {
+        'settings': {
+            'resolutions': [f'{width}x{height}' for width, height in args.resolutions],
+            'frames': args.frames, 'fps': args.fps, 'seed': args.seed,
+            'decodeWorkers': args.decode_workers, **options,
+        },
+        'machine': {
+            'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
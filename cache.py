@@ -0,0 +1,129 @@
+###
+# Cache:
+#       Keeps the strands made by vidToDna and the videos made by decodeDNA, so the same work is never done twice
+#           cache = Cache('dna-cache', maxBytes=50 << 30)
+#           vidToDna("original-videos/food.mp4", cache=cache)
+#           decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_rip", "rip", cache=cache)
+#       Results are found by a hash of the input file's contents and every parameter that changes the output
+#       (posterization, mutation, seed, format version, ...), not by file names, so a renamed or
+#       copied input still hits, and a changed input misses
+#       A hit copies the cached files to where they would have been written
+#       Entries are folders under the cache directory, one per key, with every file of a result
+#       (a strand and its index, or a video)
+#       When the cache is bigger than maxBytes the least recently used entries are removed
+#       Decodes with a random mutation and no seed are never cached (every run is different)
+###
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from functools import lru_cache
+
+
+hashChunkSize = 1 << 22
+# staging folders older than this are left over from a run that stopped while writing an entry
+stagingTimeout = 60 * 60
+
+
+# sha256 of a file's contents, remembered while the file stays the same size and age
+@lru_cache(maxsize=256)
+def fileHash(path, size, modified):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(hashChunkSize)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def contentHash(path):
+    stat = os.stat(path)
+    return fileHash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+# the key of a result: what made it (kind), the input's contents and the parameters
+def cacheKey(kind, inputPath, **params):
+    described = json.dumps({'kind': kind, 'input': contentHash(inputPath), **params}, sort_keys=True)
+    return hashlib.sha256(described.encode()).hexdigest()
+
+
+def folderSize(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class Cache:
+    def __init__(self, directory='dna-cache', maxBytes=20 << 30):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, key)
+
+    # files is {name in the entry: path}, a hit copies every one of them to its path
+    # returns False (and copies nothing) if the key is not cached
+    def get(self, key, files):
+        entry = self.entryPath(key)
+        if not os.path.isdir(entry) or not all(os.path.exists(os.path.join(entry, name)) for name in files):
+            return False
+        for name, path in files.items():
+            shutil.copyfile(os.path.join(entry, name), path)
+        # last used, for eviction
+        os.utime(entry)
+        return True
+
+    # files is {name in the entry: path}, paths that do not exist are left out (a strand without an index)
+    # the entry is written to a temporary folder first, so a half written entry is never found
+    # a result bigger than maxBytes is not cached (eviction would remove it right away)
+    def put(self, key, files):
+        entry = self.entryPath(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+        if sum(os.path.getsize(path) for path in files.values() if os.path.exists(path)) > self.maxBytes:
+            return
+        staging = os.path.join(self.directory, f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(staging)
+        try:
+            for name, path in files.items():
+                if os.path.exists(path):
+                    shutil.copyfile(path, os.path.join(staging, name))
+            os.rename(staging, entry)
+        except OSError:
+            # another run cached the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+
+    # least recently used first, until the cache fits in maxBytes
+    # also removes staging folders left behind by runs that stopped in put
+    def evict(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if not item.is_dir():
+                continue
+            if not item.name.startswith('.'):
+                entries.append((item.stat().st_mtime, item.path, folderSize(item.path)))
+            elif time.time() - item.stat().st_mtime > stagingTimeout:
+                shutil.rmtree(item.path, ignore_errors=True)
+        total = sum(size for used, path, size in entries)
+        for used, path, size in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def size(self):
+        return sum(folderSize(item.path) for item in os.scandir(self.directory)
+                   if item.is_dir() and not item.name.startswith('.'))
+
+    def clear(self):
+        for item in os.scandir(self.directory):
+            if item.is_dir():
+                shutil.rmtree(item.path, ignore_errors=True)
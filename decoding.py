@@ -12,11 +12,27 @@
 #           write pixel to image
 #       concat images to video with same fps
 #       return video 
+#       Mutations are looked up by name in the mutations registry (new ones can be added there)
+#       and draw from a numpy Generator, so a decode with a seed can be repeated exactly
+#       Frames can also be read straight from the strand, without writing a video:
+#           iterFrames(path, mutation, start, stop, step) - yields the frames as numpy arrays
+#       Strands written with keyframes can also be decoded from the nearest keyframe:
+#           decodeFrame(path, n) - frame n
+#           decodeRange(path, start, stop) - frames start to stop - 1
 # ###
 
+import contextlib
 import cv2
 import numpy as np
-import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cache import cacheKey
+from pipeline import ThreadedWriter, threaded
+from functools import lru_cache
+from strand import (CodesReader, canonicalCodes, entropyHeaderSize, formatVersion, headerSize, isKeyframe,
+                    longRunVersion, maxCodeLength, nearestKeyframe, openStrand, parseHeader, readIndex, tileCount,
+                    tileOrder)
 
 decodingDict = {
     'A': 0,
@@ -52,15 +68,15 @@ def toBases(num, pad):
     return encodedNum
 
 
-def highDecoding(sequence):
-    pixels = []
-    for s in sequence:
-        if s == 'A' or s == 'C':
-            pixels.append([0, 0, 0])
-        else:
-            pixels.append([255, 255, 255])
-    return pixels
+# the decoder works on base codes, A = 0, T = 1, C = 2, G = 3
+# (the strand reader turns letters into codes, see strand.py)
+A, T, C, G = 0, 1, 2, 3
+
+# number of bases for a pixel's colors
+literalWidth = {'high': 1, 'med': 6, 'low': 9, 'none': 12}
 
+# High: A or C --> black, T or G --> white (one base per pixel)
+highDecodingTable = np.array([0, 255, 0, 255], dtype=np.uint8)
 
 medDecodingDict = {
     'AC': 0,
@@ -70,218 +86,744 @@ medDecodingDict = {
     'CG': 200,
     'AT': 250
  }   
+# 2 bases per color, looked up by 4 * first + second
+medDecodingTable = np.zeros(16, dtype=np.uint8)
+for bases, color in medDecodingDict.items():
+    medDecodingTable[fromBases(bases)] = color
 
+# Low: 3 bases per color times 5 (wrapping to a byte like the frames do)
+lowDecodingTable = (np.arange(64) * 5).astype(np.uint8)
 
-def medDecoding(sequence):
-    pixels = []
-    for c in range(0, len(sequence), 2):
-        pixels.append(medDecodingDict[sequence[c:c+2]])
-    return np.array(pixels).reshape(-1, 3)
+# RIP: C --> T in the 4 bases of each color
+ripTable = np.array([fromBases(toBases(color, 4).replace('C', 'T')) for color in range(256)], dtype=np.uint8)
 
 
-def lowDecoding(sequence):
-    pixels = []
-    for c in range(0, len(sequence), 3):
-        pixels.append(fromBases(sequence[c:c+3]) * 5)
-    return np.array(pixels).reshape(-1, 3)
+# codes (n x literal width) --> colors (n x 3)
+def decodeColors(codes, posterization):
+    if posterization == 'high':
+        return np.repeat(highDecodingTable[codes], 3, axis=1)
+    codes = codes.astype(np.intp)
+    if posterization == 'med':
+        return medDecodingTable[codes[:, 0::2] * 4 + codes[:, 1::2]]
+    elif posterization == 'low':
+        return lowDecodingTable[codes[:, 0::3] * 16 + codes[:, 1::3] * 4 + codes[:, 2::3]]
+    return (codes[:, 0::4] * 64 + codes[:, 1::4] * 16 + codes[:, 2::4] * 4 + codes[:, 3::4]).astype(np.uint8)
 
 
-def noneDecoding(sequence):
-    pixels = []
-    for c in range(0, len(sequence), 4):
-        pixels.append(fromBases(sequence[c:c+4]))
-    return np.array(pixels).reshape(-1, 3)
-        
+# posterization, fps, width, height (and keyframe interval for versioned strands), see strand.py
+def readHeader(strand):
+    codes, atEnd = strand.window(0, entropyHeaderSize)
+    size = headerSize(codes)
+    if size > len(codes):
+        # the color table
+        codes, atEnd = strand.window(0, size)
+    return parseHeader(codes)
+
+
+# lookups for the literals of a strand with a color table (version 4), see canonicalCodes in strand.py
+#   symbols: the next maxCodeLength bases as a number --> the symbol whose code they start with
+#   steps: symbol --> bases after the C (the code, and for the escape code the colors after it)
+#   colorCodes: symbol --> its colors as in a literal
+# bases that start no code (only in damaged strands) are read as one base of black
+@lru_cache(maxsize=8)
+def colorDecoder(colorTable, posterization):
+    width = literalWidth[posterization]
+    lengths = [colorTable.escapeLength] + list(colorTable.lengths)
+    unknown = len(lengths)
+    symbols = np.full(4 ** maxCodeLength, unknown, dtype=np.int32)
+    for symbol, (length, value) in enumerate(zip(lengths, canonicalCodes(lengths))):
+        shift = 2 * (maxCodeLength - length)
+        symbols[value << shift:(value + 1) << shift] = symbol
+    steps = np.array(lengths + [1], dtype=np.int64)
+    steps[0] += width
+    colorCodes = np.zeros((unknown + 1, width), dtype=np.uint8)
+    colorCodes[1:unknown] = np.frombuffer(colorTable.colors, dtype=np.uint8).reshape(-1, width)
+    return symbols, steps, colorCodes
+
+
+# Tokens
+    # after the first frame a frame is a list of tokens
+    #   G + 2 bases --> run of pixels copied from the previous frame
+    #   any other base + a pixel's colors --> changed pixel
+    # from version 2 on (see strand.py) A and T are tokens of their own
+    #   A + 1 base n + 3 * (n + 1) bases --> run of any length
+    #   T --> the rest of the frame is copied from the previous frame
+    #   C + a pixel's colors --> changed pixel
+    # from version 4 on the colors can be a code from the color table (see colorDecoder), so literals
+    # differ in length and every one is a streak of its own
+    # sickle mutations change how tokens are read (see the mutations below)
+    #   GAG --> GTG makes runs of 3 into runs of 7
+    #   CTC --> CAC changes the first base of the colors to A, and a literal starting
+    #   with T but not followed by C is dropped (only its first base is used, from
+    #   version 2 on the whole literal)
+# tokens are read in streaks: stretches of tokens of the same kind sit at a
+# fixed distance from each other, so every streak is found with array lookups
+# and only the jumps from streak to streak are followed one by one
+runToken, literalToken, droppedToken, stopToken, longRunToken, restToken = 0, 1, 2, 3, 4, 5
+longRunKinds = np.array([longRunToken, restToken, literalToken, runToken], dtype=np.uint8)
+blockSize = 1 << 20
+lookahead = 32
+
+
+# for every position p, the first position p + k * step that is in stops
+def nextStop(stops, step):
+    length = -(-len(stops) // step) * step
+    positions = np.arange(length, dtype=np.int32)
+    positions[:len(stops)][~stops] = length
+    streakEnds = np.empty((length // step, step), dtype=np.int32)
+    np.minimum.accumulate(positions.reshape(-1, step)[::-1], axis=0, out=streakEnds[::-1])
+    return streakEnds.ravel()
+
+
+# reads the tokens of one block of the strand
+    # codes: block of base codes, atEnd: whether the block reaches the end of the strand
+    # pixels: pixels of the frame done so far
+# returns (bases used, pixels done, run tokens read, pixels of the literal tokens, their colors)
+def readTokens(codes, atEnd, pixels, header, mutation, frameSize=None):
+    n = len(codes)
+    posterization = header.posterization
+    if frameSize is None:
+        frameSize = header.width * header.height
+    step = 1 + literalWidth[posterization]
+    padded = np.concatenate((codes, np.full(lookahead, 255, dtype=np.uint8)))
+    # kind of the token starting at every position
+    kinds = np.full(n + lookahead, stopToken, dtype=np.uint8)
+    if header.version >= longRunVersion:
+        kinds[:n] = longRunKinds[codes]
+        # a dropped literal is skipped whole, the next base could be read as a T otherwise
+        droppedStep = step
+    else:
+        kinds[:n] = codes != G
+        droppedStep = 1
+    if mutation.rewritesLiterals:
+        kinds[:n][(kinds[:n] == literalToken) & (padded[1:n + 1] == T) & (padded[2:n + 2] != C)] = droppedToken
+    coded = header.colorTable is not None
+    if coded:
+        # the code starting at every position, and the symbol and length of the literal starting one before
+        symbols, symbolSteps, symbolColors = colorDecoder(header.colorTable, posterization)
+        digits = np.zeros(n + lookahead + maxCodeLength, dtype=np.int32)
+        digits[:n] = codes
+        codeIndex = np.zeros(n + lookahead, dtype=np.int32)
+        for k in range(maxCodeLength):
+            codeIndex *= 4
+            codeIndex += digits[k:k + n + lookahead]
+        literalSymbols = np.full(n + lookahead, len(symbolSteps) - 1, dtype=np.int32)
+        literalSymbols[:-1] = symbols[codeIndex[1:]]
+        literalSteps = 1 + symbolSteps[literalSymbols]
+    if atEnd:
+        # tokens cut off by the end of the strand are not read
+        tail = np.arange(max(n - lookahead, 0), n)
+        steps = np.array([3, step, droppedStep, 0, 0, 1], dtype=np.int64)[kinds[tail]]
+        if coded:
+            isLiteral = (kinds[tail] == literalToken) | (kinds[tail] == droppedToken)
+            steps[isLiteral] = literalSteps[tail[isLiteral]]
+        isLongRun = kinds[tail] == longRunToken
+        steps[isLongRun] = 2 + 3 * (padded[tail[isLongRun] + 1].astype(np.int64) + 1)
+        kinds[tail[tail + steps > n]] = stopToken
+    else:
+        kinds[n - lookahead:] = stopToken
+    # run lengths summed down each line of positions 3 apart, a streak of runs
+    # only ever sums positions holding runs
+    runLengths = np.zeros(-(-n // 3) * 3, dtype=np.int32)
+    runLengths[:n] = padded[1:n + 1] * 4 + padded[2:n + 2]
+    if mutation.lengthensRuns:
+        runLengths[runLengths == 3] = 7
+    runSums = runLengths.reshape(-1, 3).cumsum(axis=0, dtype=np.int32).ravel()
+    # long runs are read 3 digits at a time, the number starting at every position
+    digitTriples = np.zeros(n + lookahead, dtype=np.int32)
+    if header.version >= longRunVersion:
+        digitTriples[:n] = padded[:n] * 16 + padded[1:n + 1] * 4 + padded[2:n + 2]
+    # where the streak starting at every position ends
+    runEnds = nextStop(kinds != runToken, 3)
+    if coded:
+        literalEnds = np.arange(n + lookahead) + literalSteps
+    else:
+        literalEnds = nextStop(kinds != literalToken, step)
+
+    # following the streaks until the frame is done
+    kindsView, runEndsView, literalEndsView, runSumsView, paddedView, digitTriplesView = (
+        memoryview(kinds), memoryview(runEnds), memoryview(literalEnds), memoryview(runSums),
+        memoryview(padded), memoryview(digitTriples))
+    streaks, gains = [], []
+    done = pixels
+    p = 0
+    while done < frameSize:
+        kind = kindsView[p]
+        if kind == runToken:
+            q = runEndsView[p]
+            gain = runSumsView[q - 3] - (runSumsView[p - 3] if p >= 3 else 0)
+        elif kind == literalToken:
+            q = literalEndsView[p]
+            gain = 1 if coded else (q - p) // step
+        elif kind == droppedToken:
+            q = literalEndsView[p] if coded else p + droppedStep
+            gain = 0
+        elif kind == longRunToken:
+            q = p + 5 + 3 * paddedView[p + 1]
+            gain = 0
+            for triple in range(p + 2, q, 3):
+                gain = gain * 64 + digitTriplesView[triple]
+        elif kind == restToken:
+            q = p + 1
+            gain = frameSize - done
+        else:
+            break
+        streaks.append(p)
+        gains.append(gain)
+        done += gain
+        p = q
+    streaks = np.array(streaks, dtype=np.int64)
+    gains = np.array(gains, dtype=np.int64)
+    # (a streak of runs can also reach the end of the frame and go on with empty runs, like the
+    # GAA a keyframe's colors can start with)
+    if done > frameSize or (done == frameSize and len(streaks) and kinds[streaks[-1]] == runToken):
+        # the frame ends inside the last streak, the rest belongs to the next frame
+        last = streaks[-1]
+        remaining = frameSize - (done - gains[-1])
+        if kinds[last] == runToken:
+            before = runSums[last] - runLengths[last]
+            count = np.searchsorted(runSums[last:runEnds[last]:3] - before, remaining) + 1
+            p = int(last + 3 * count)
+        elif kinds[last] == literalToken:
+            p = int(last + remaining * step)
+        # (a long run is used up whole)
+        gains[-1] = remaining
+        done = frameSize
+    # runs: 3 bases each in a streak of runs, long runs and the rest of the frame are one token
+    streakKinds = kinds[streaks]
+    streakBases = np.append(streaks[1:], p) - streaks
+    runs = int((streakBases[streakKinds == runToken] // 3).sum()
+               + np.count_nonzero((streakKinds == longRunToken) | (streakKinds == restToken)))
+
+    # every literal token of the block, and the pixel it goes to
+    firstPixels = pixels + np.cumsum(gains) - gains
+    isLiteral = streakKinds == literalToken
+    starts, counts, firstPixels = streaks[isLiteral], gains[isLiteral], firstPixels[isLiteral]
+    inStreak = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(starts, counts) + inStreak * step
+    literalPixels = np.repeat(firstPixels, counts) + inStreak
+    if coded:
+        literalSymbols = literalSymbols[positions]
+        colorCodes = symbolColors[literalSymbols]
+        escaped = literalSymbols == 0
+        escapeStart = 1 + header.colorTable.escapeLength
+        colorCodes[escaped] = padded[positions[escaped, None] + np.arange(escapeStart, escapeStart + step - 1)]
+    else:
+        colorCodes = padded[positions[:, None] + np.arange(1, step)]
+    if mutation.rewritesLiterals:
+        # CTC --> CAC
+        colorCodes[colorCodes[:, 0] == T, 0] = A
+    return p, done, runs, literalPixels, decodeColors(colorCodes, posterization)
+
+
+# the colors of a keyframe, where every pixel's colors are written out
+# returns the bases used, the number of pixels decoded and their colors
+def readKeyframe(strand, i, frameSize, posterization):
+    width = literalWidth[posterization]
+    colors = np.zeros((frameSize, 3), dtype=np.uint8)
+    done = 0
+    while done < frameSize:
+        count = min(frameSize - done, blockSize // width)
+        codes, atEnd = strand.window(i, count * width)
+        count = len(codes) // width
+        colors[done:done + count] = decodeColors(codes[:count * width].reshape(count, width), posterization)
+        i += count * width
+        done += count
+        if atEnd:
+            break
+    return i, done, colors[:done]
+
+
+# the tile map of a frame (version 3), see tileOrder in strand.py
+# returns the pixels of the changed tiles in the order they are written, and the bases used
+# (None if the map is cut off by the end of the strand)
+def readTileMap(codes, header):
+    tiles = tileCount(header.width, header.height, header.tileSize)
+    codes = codes[:tiles]
+    mapEnds = np.flatnonzero(codes == T)
+    if len(mapEnds):
+        codes, used = codes[:mapEnds[0]], mapEnds[0] + 1
+    elif len(codes) == tiles:
+        used = tiles
+    else:
+        return None, 0
+    changedTiles = np.zeros(tiles, dtype=bool)
+    changedTiles[:len(codes)] = codes == C
+    order, tileOf = tileOrder(header.width, header.height, header.tileSize)
+    return order[changedTiles[tileOf]], int(used)
+
+
+# Mutations
+# a mutation is a class with hooks into decoding, one is made for every decode
+#   lengthensRuns, rewritesLiterals - the sickle changes to reading tokens
+#   random - whether it draws from rng (without a seed every decode is different)
+#   copyPrevious - how a frame starts out from the previous frame
+#   changeLiterals - which changed pixels get their new colors
+#   changeFrame - changes to the finished frame (they carry over to the next frame)
+# random choices come from rng, a numpy Generator shared by the whole decode
+class Mutation:
+    lengthensRuns = False
+    rewritesLiterals = False
+    random = False
+
+    def __init__(self, width, height, rng):
+        self.rng = rng
+
+    def copyPrevious(self, prevFrame, frame):
+        np.copyto(frame, prevFrame)
+
+    def changeLiterals(self, literalPixels, colors):
+        return literalPixels, colors
+
+    def changeFrame(self, frame):
+        pass
+
+
+# Recessive: 25% chance for the previous pixel to remain
+class Recessive(Mutation):
+    random = True
+
+    def changeLiterals(self, literalPixels, colors):
+        changed = self.rng.random(len(literalPixels)) >= 0.25
+        return literalPixels[changed], colors[changed]
+
+
+# Sickle: GAG --> GTG, CTC --> CAC (sickle1 only the first, sickle2 only the second)
+class Sickle(Mutation):
+    lengthensRuns = True
+    rewritesLiterals = True
+
+
+class Sickle1(Mutation):
+    lengthensRuns = True
+
+
+class Sickle2(Mutation):
+    rewritesLiterals = True
+
+
+# RIP: C --> T in the colors of pixels copied from the previous frame
+class Rip(Mutation):
+    def copyPrevious(self, prevFrame, frame):
+        cv2.LUT(prevFrame, ripTable, dst=frame)
+
+
+# Cancer: every cancerous pixel turns black, 10% chance to spread to each neighbor
+# (starting from the center pixel)
+class Cancer(Mutation):
+    random = True
+
+    def __init__(self, width, height, rng):
+        super().__init__(width, height, rng)
+        self.cancerous = np.zeros((height, width), dtype=bool)
+        if width and height:
+            self.cancerous[height // 2, width // 2] = True
+
+    def changeFrame(self, frame):
+        height, width = self.cancerous.shape
+        rows, cols = np.nonzero(self.cancerous)
+        frame[rows, cols] = 0
+        # left, right, up, down
+        spreads = self.rng.random((4, len(rows))) < 0.1
+        spreadRows = np.concatenate((rows[spreads[0]], rows[spreads[1]], rows[spreads[2]] - 1, rows[spreads[3]] + 1))
+        spreadCols = np.concatenate((cols[spreads[0]] - 1, cols[spreads[1]] + 1, cols[spreads[2]], cols[spreads[3]]))
+        inside = (spreadRows >= 0) & (spreadRows < height) & (spreadCols >= 0) & (spreadCols < width)
+        spreadRows, spreadCols = spreadRows[inside], spreadCols[inside]
+        frame[spreadRows, spreadCols] = 0
+        self.cancerous[spreadRows, spreadCols] = True
+
 
+mutations = {
+    'none': Mutation,
+    'recessive': Recessive,
+    'sickle': Sickle,
+    'sickle1': Sickle1,
+    'sickle2': Sickle2,
+    'rip': Rip,
+    'cancer': Cancer,
+}
+
+
+def mutationType(mutation):
+    if mutation not in mutations:
+        raise ValueError(f'unknown mutation {mutation}, expected one of {", ".join(mutations)}')
+    return mutations[mutation]
+
+
+# Reads the tokens of every frame, in order
+# yields (keyframe, first base, end, pixels done, run tokens, pixels of the literal tokens, their colors)
+# for every frame (for keyframes the literal pixels are None and every pixel has colors)
+def frameTokens(strand, header, mutation, frameNumber, i):
+    posterization = header.posterization
+    frameSize = header.width * header.height
+    frameBases = blockSize
+    while i < len(strand):
+        frameStart = i
+        if isKeyframe(header, frameNumber):
+            keyframe = True
+            runs = 0
+            literalPixels = None
+            i, done, colors = readKeyframe(strand, i, frameSize, posterization)
+        # rest of frames - runs copy the previous frame, literals are filled in after
+        else:
+            keyframe = False
+            # with tiles, only the pixels of changed tiles have tokens
+            pixelOrder = None
+            count = frameSize
+            if header.tileSize:
+                codes, atEnd = strand.window(i, tileCount(header.width, header.height, header.tileSize))
+                pixelOrder, used = readTileMap(codes, header)
+                if pixelOrder is None:
+                    return
+                i += used
+                count = len(pixelOrder)
+            done = 0
+            runs = 0
+            # (a frame with no changed tiles has no tokens at all)
+            literalPixels, colors = [np.empty(0, dtype=np.int64)], [np.empty((0, 3), dtype=np.uint8)]
+            # frames are usually about as long as the last one, bigger windows if not
+            size = min(frameBases + frameBases // 8 + 4096, blockSize)
+            while done < count:
+                codes, atEnd = strand.window(i, size + lookahead)
+                used, done, blockRuns, blockPixels, blockColors = readTokens(codes, atEnd, done, header, mutation,
+                                                                             count)
+                i += used
+                runs += blockRuns
+                size = min(2 * size, blockSize)
+                literalPixels.append(blockPixels)
+                colors.append(blockColors)
+                if atEnd:
+                    break
+            literalPixels = np.concatenate(literalPixels)
+            colors = np.concatenate(colors)
+            if pixelOrder is not None:
+                literalPixels = pixelOrder[literalPixels]
+                # the unchanged tiles are done too
+                done += frameSize - count
+            frameBases = i - frameStart
+        if done == 0:
+            return
+        yield keyframe, frameStart, i, done, runs, literalPixels, colors
+        frameNumber += 1
+        if done < frameSize:
+            return
+
+
+# reads the tokens of the frames in codes, from frame frameNumber on (start: where codes are in the strand)
+# this is the part run in the worker processes
+def readFrames(codes, header, mutation, frameNumber, start):
+    return [(keyframe, start + frameStart, start + end, done, runs, literalPixels, colors)
+            for keyframe, frameStart, end, done, runs, literalPixels, colors
+            in frameTokens(CodesReader(codes), header, mutation, frameNumber, 0)]
+
+
+# Parallel decoding
+# the index (see readIndex in strand.py) has where every frame starts, so worker processes read the
+# tokens and colors of whole frames on their own, taskFrames frames in a row at a time, and the frames
+# are put together in order by decodeFrames (the only part that needs the previous frame)
+# at most maxInFlight frames are being read at once (at least a task per worker)
+# without an index, or with a sickle mutation (it moves where frames end), the frames are read here,
+# one after another, like with one worker
+taskFrames = 8
 
-def decodeDNA(encodedFile, outputPath, mutation='none'):
-    with open(encodedFile, 'r') as f:
-        dna = f.read()
-        # getting posterization
-        pBase = dna[0]
-        if pBase == 'A':
-            posterization = 'high'
-        elif pBase == 'T':
-            posterization = 'med'
-        elif pBase == 'C':
-            posterization = 'low'
+def parallelFrameTokens(strand, header, mutation, frameNumber, i, workers, maxInFlight, index=()):
+    starts = [(number, position) for number, position in index if number >= frameNumber]
+    if not starts or starts[0] != (frameNumber, i) or mutation.lengthensRuns or mutation.rewritesLiterals:
+        yield from frameTokens(strand, header, mutation, frameNumber, i)
+        return
+    tasks = [starts[0]]
+    for number, position in starts[1:]:
+        if number - tasks[-1][0] >= taskFrames:
+            tasks.append((number, position))
+    # a task cut short (a damaged strand) ends the decode there, like it would without workers
+    ends = tasks[1:] + [(None, len(strand))]
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for (number, start), (nextNumber, end) in zip(tasks, ends):
+            codes, atEnd = strand.window(start, end - start)
+            pending.append((pool.submit(readFrames, codes.copy(), header, mutation, number, start),
+                            nextNumber - number if nextNumber is not None else None))
+            if len(pending) < max(workers, maxInFlight // taskFrames) and nextNumber is not None:
+                continue
+            while pending:
+                future, frameCount = pending.popleft()
+                frames = future.result()
+                yield from frames
+                if frameCount is not None and len(frames) < frameCount:
+                    return
+                if nextNumber is not None:
+                    break
+
+
+# Puts frames together from their tokens, with a mutation
+# the frame and the previous frame are swapped for every frame, so a frame is only valid until the next one
+# the tokens are only read, so the same tokens can go to the decoders of many mutations
+class FrameDecoder:
+    def __init__(self, header, mutation='none', seed=None):
+        width, height = header.width, header.height
+        self.frame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.prevFrame = np.zeros((height, width, 3), dtype=np.uint8)
+        self.mutator = mutationType(mutation)(width, height, np.random.default_rng(seed))
+
+    def decode(self, keyframe, done, literalPixels, colors):
+        self.frame, self.prevFrame = self.prevFrame, self.frame
+        frame = self.frame
+        pixels = frame.reshape(-1, 3)
+        if keyframe:
+            pixels[:done] = colors
         else:
-            posterization = 'none'
-        # getting info
-        fps = fromBases(dna[1:5])
-        width = fromBases(dna[5:11])
-        height = fromBases(dna[11:17])
+            self.mutator.copyPrevious(self.prevFrame, frame)
+            literalPixels, colors = self.mutator.changeLiterals(literalPixels, colors)
+            pixels[literalPixels] = colors
+        # need check after adding mutations
+        pixels[done:] = 0
+        self.mutator.changeFrame(frame)
+        return frame
+
+
+# Decodes every frame of the strand
+# frames are built in place in two buffers (the frame and the previous frame),
+# so a yielded frame is only valid until the next one is asked for
+# decoding can start at a keyframe: its frame number and the position of its first base
+# workers > 1 reads the frames' tokens in that many processes, see parallelFrameTokens
+# (index: the strand's frame index, from readIndex, without it the frames are read in this process)
+# seed makes the random choices of the mutation the same every time
+# metrics (see metrics.py) times reading the tokens and putting the frames together, and counts
+# the runs, literals and bases of every frame
+# the frame's stats go to metrics when the next frame is asked for, with the time the frame was
+# away as its write (what decodeDNA does with every frame)
+# pipelineDepth > 0 reads the tokens in their own thread, at most pipelineDepth frames ahead
+def decodeFrames(strand, mutation='none', frameNumber=0, i=None, workers=1, maxInFlight=16, seed=None, metrics=None,
+                 pipelineDepth=0, index=()):
+    header = readHeader(strand)
+    mutationClass = mutationType(mutation)
+    decoder = FrameDecoder(header, mutation, seed)
+    if i is None:
+        i = header.size
+    if workers > 1:
+        frames = parallelFrameTokens(strand, header, mutationClass, frameNumber, i, workers, maxInFlight, index)
+    else:
+        frames = frameTokens(strand, header, mutationClass, frameNumber, i)
+    if pipelineDepth:
+        frames = threaded(frames, pipelineDepth)
+    tokensStart = time.perf_counter()
+    for keyframe, start, end, done, runs, literalPixels, colors in frames:
+        frameStart = time.perf_counter()
+        literals = done if keyframe else len(literalPixels)
+        frame = decoder.decode(keyframe, done, literalPixels, colors)
+        frameEnd = time.perf_counter()
+        yield frame
+        written = time.perf_counter()
+        if metrics is not None:
+            metrics.frame(frameNumber, {'tokens': frameStart - tokensStart, 'frame': frameEnd - frameStart,
+                                        'write': written - frameEnd, 'runTokens': runs,
+                                        'literalTokens': literals, 'changedPixels': literals,
+                                        'pixels': header.width * header.height, 'bases': end - start})
+        frameNumber += 1
+        tokensStart = time.perf_counter()
+
+
+# Frames without a video
+# yields frames start, start + step, ... before stop (None = to the end) as uint8 (height, width, 3) BGR arrays,
+# the same frames decodeDNA would write, without the MJPG compression
+# decoding starts at the closest keyframe before start (the first frame if the strand has
+# no keyframes or no index) and the frames before start (and between steps) are decoded but not kept
+# copy=False yields decodeFrames' own buffers, which are only valid until the next frame
+# the strand is closed when the generator is done or closed
+def iterFrames(encodedFile, mutation='none', start=0, stop=None, step=1, seed=None, workers=1, pipelineDepth=0, copy=True):
+    if step < 1:
+        raise ValueError(f'step must be at least 1, not {step}')
+    with openStrand(encodedFile) as strand:
+        index = readIndex(encodedFile)
+        frameNumber, i = nearestKeyframe(readHeader(strand), index, start)
+        if stop is not None and frameNumber >= stop:
+            return
+        frames = decodeFrames(strand, mutation, frameNumber, i, workers=workers, seed=seed, pipelineDepth=pipelineDepth,
+                              index=index)
+        try:
+            for frame in frames:
+                if frameNumber >= start and (frameNumber - start) % step == 0:
+                    yield frame.copy() if copy else frame
+                frameNumber += 1
+                if stop is not None and frameNumber >= stop:
+                    break
+        finally:
+            frames.close()
+
+
+# Random access
+def decodeRange(encodedFile, start, stop, mutation='none', seed=None):
+    return list(iterFrames(encodedFile, mutation, start, stop, seed=seed))
+
+
+# a single frame, None if the strand is shorter
+def decodeFrame(encodedFile, n, mutation='none', seed=None):
+    frames = decodeRange(encodedFile, n, n + 1, mutation, seed)
+    return frames[0] if frames else None
+
+
+# workers > 1 decodes in that many processes, with the strand's index, see parallelFrameTokens
+# metrics (see metrics.py) times every stage and calls its hooks after every frame, in place of the progress printing
+# pipelineDepth > 0 reads the strand, puts frames together and writes the video at the same time (in threads),
+# with at most pipelineDepth frames waiting between them
+# cache (see cache.py) copies out a video already decoded from the same strand with the same mutation and seed
+# instead of decoding it again, and keeps the videos it does decode
+def decodeDNA(encodedFile, outputPath, mutation='none', workers=1, seed=None, metrics=None, pipelineDepth=0, cache=None):
+    key = decodeKey(encodedFile, mutation, seed) if cache is not None else None
+    if key is not None and cache.get(key, {'video': outputPath + '.avi'}):
+        print(f"Decoding found in cache. Video at {outputPath + '.avi'}")
+        return outputPath + '.avi'
+    # the strand (text or packed) is read a window at a time, never all at once
+    with openStrand(encodedFile) as strand:
+        header = readHeader(strand)
         # setting up video
         fourcc = cv2.VideoWriter_fourcc(*'MJPG')
         out_filename = outputPath + '.avi'
-        fps = float(fps)
-        vid = cv2.VideoWriter(out_filename, fourcc, fps, (width, height))
-        # now getting the frames
-        i = 17
-        frame = [] # starting with the frame being flat
-        frameSize = width * height
-        prevFrame = None
+        fps = float(header.fps)
+        vid = cv2.VideoWriter(out_filename, fourcc, fps, (header.width, header.height))
+        if metrics is not None:
+            metrics.start()
         frameCount = 0
-        cancerous = {}
-        cancerous[height // 2] = [width // 2]
-        while i < len(dna):
-            # first frame
-            if prevFrame is None:
-                if posterization == 'high':
-                    frame = highDecoding(dna[i: i + frameSize])
-                    i += frameSize
-                elif posterization == 'med':
-                    # 3 colors per pixel, 2 bases per color
-                    frame = medDecoding(dna[i: i + (frameSize * 6)])
-                    i += frameSize * 6
-                elif posterization == 'low':
-                    # 3 colors per pixel, 3 bases per color
-                    frame = lowDecoding(dna[i : i + (frameSize * 9)])
-                    i += frameSize * 9
-                else: # no posterization
-                    # 3 colors per pixel, 4 bases per color
-                    frame = noneDecoding(dna[i: i + (frameSize * 12)])
-                    i += frameSize * 12
-            # rest of frames - check for run-length encoding
-            else:
-                # run-length encoding
-                if dna[i] == 'G':
-                    i += 1
-                    # next two bases give run length
-                    runLength = fromBases(dna[i:i+2])
-                    i += 2
-                    # sickle: GAG --> GTG (AG = 3, TG = 7)
-                    if (mutation == "sickle" or mutation == 'sickle1') and runLength == 3:
-                        runLength = 7
-                        if len(frame) + 7 > frameSize:
-                            runLength = frameSize - len(frame)
-                    for run in range(0, runLength):
-                        if len(frame) < frameSize: # need this check for sickle mutation
-                            pixelIndex = len(frame)
-                            if mutation == 'rip':
-                                dupe = prevFrame[pixelIndex]
-                                newPixel = []
-                                for color in dupe:
-                                    baseColor = toBases(color, 4)
-                                    baseColor = baseColor.replace('C', 'T')
-                                    newColor = fromBases(baseColor)
-                                    newPixel.append(newColor)
-                                frame.append(newPixel)
-                            else:
-                                frame.append(prevFrame[pixelIndex])
-                # change from prev frame
+        index = readIndex(encodedFile) if workers > 1 else []
+        writer = ThreadedWriter(vid.write, pipelineDepth) if pipelineDepth else None
+        try:
+            # (with metrics, decodeFrames times the writes)
+            for frame in decodeFrames(strand, mutation, workers=workers, seed=seed, metrics=metrics,
+                                      pipelineDepth=pipelineDepth, index=index):
+                # frames are reused by decodeFrames, so the writer thread gets its own copy
+                if writer is not None:
+                    writer.put(frame.copy())
                 else:
-                    i += 1 # 'C'
-                    if (mutation == 'sickle' or mutation == 'sickle2') and dna[i] == 'T':
-                        if i + 1 < len(dna) and dna[i + 1] == 'C':
-                            if posterization == 'high':
-                                for pixel in highDecoding('A'):
-                                    frame.append(pixel)
-                                i += 1
-                            elif posterization == 'med':
-                                for pixel in medDecoding('A' + dna[i+1:i+6]):
-                                    frame.append(pixel)
-                                i += 6
-                            elif posterization == 'low':
-                                for pixel in lowDecoding('A' + dna[i+1:i+9]):
-                                    frame.append(pixel)
-                                i += 9
-                            else:
-                                for pixel in noneDecoding('A' + dna[i+1:i+12]):
-                                    frame.append(pixel)
-                                i += 12
-                    elif mutation == 'recessive' and (random.random() < 0.25):
-                        frame.append(prevFrame[len(frame)])
-                        if posterization == 'high':
-                            i += 1
-                        elif posterization == 'med':
-                            i += 6
-                        elif posterization == 'low':
-                            i += 9
-                        else:
-                            i += 12
-                    elif posterization == 'high':
-                        for pixel in highDecoding(dna[i]):
-                            frame.append(pixel)
-                        i += 1
-                    elif posterization == 'med':
-                        for pixel in medDecoding(dna[i: i+6]):
-                            frame.append(pixel)
-                        i += 6
-                    elif posterization == 'low':
-                        for pixel in lowDecoding(dna[i: i+9]):
-                            frame.append(pixel)
-                        i += 9
-                    else: # no posterization
-                        for pixel in noneDecoding(dna[i: i+12]):
-                            frame.append(pixel)
-                        i += 12
-            if len(frame) == frameSize:
-                # write to video
-                if mutation == 'cancer':
-                    spread = []
-                    for row in cancerous.keys():
-                        for pixel in cancerous[row]:
-                            frame[(row * width) + pixel] = [0, 0, 0]
-                            if random.random() < 0.1:
-                                if pixel > 0 and (pixel - 1) not in cancerous[row]:
-                                    spread.append([row, pixel - 1])
-                                    frame[(row * width) + pixel - 1] = [0, 0, 0]
-                            if random.random() < 0.1:
-                                if pixel + 1 < width and (pixel + 1) not in cancerous[row]:
-                                    spread.append([row, pixel + 1])
-                                    frame[(row * width) + pixel + 1] = [0, 0, 0]
-                            if random.random() < 0.1:
-                                if row > 0 and ((row - 1) not in cancerous.keys() or pixel not in cancerous[row - 1]):
-                                    spread.append([row - 1, pixel])
-                                    frame[((row - 1) * width) + pixel] = [0, 0, 0]
-                            if random.random() < 0.1:
-                                if row + 1 < height and ((row + 1) not in cancerous.keys() or pixel not in cancerous[row + 1]):
-                                    spread.append([row + 1, pixel])
-                                    frame[((row + 1) * width) + pixel] = [0, 0, 0]
-                    for pixel in spread:
-                        if pixel[0] in cancerous.keys():
-                            cancerous[pixel[0]].append(pixel[1])
-                        else:
-                            cancerous[pixel[0]] = [pixel[1]]
-                reshapedFrame = np.array(frame).reshape(height, width, 3)
-                vid.write(reshapedFrame.astype(np.uint8))
-                prevFrame = frame
-                frame = []
+                    vid.write(frame)
                 frameCount += 1
-                if frameCount % 10 == 0:
+                if metrics is None and frameCount % 10 == 0:
                     print(f"Wrote frame {frameCount}")
-        # need check after adding mutations
-        if len(frame) != 0:
-            while len(frame) < frameSize:
-                frame.append([0, 0, 0])
-            reshapedFrame = np.array(frame).reshape(height, width, 3)
-            vid.write(reshapedFrame.astype(np.uint8))
+        finally:
+            if writer is not None:
+                writer.close()
         vid.release()
-        print(f"All frames completed! Video at {out_filename}")
+        if metrics is not None:
+            metrics.stop()
+    if key is not None:
+        cache.put(key, {'video': out_filename})
+    print(f"All frames completed! Video at {out_filename}")
     return out_filename
+
+
+# None when the video can not be cached: a random mutation without a seed
+# workers, metrics and pipelineDepth do not change the video, so they are not part of the key
+def decodeKey(encodedFile, mutation, seed):
+    if mutationType(mutation).random and seed is None:
+        return None
+    return cacheKey('decode', encodedFile, mutation=mutation, seed=seed, formatVersion=formatVersion)
         
 
-# decodeDNA("dna-encodings/bad_apple.mp4_high_encoding.txt", "decoded-videos/bad_apple_high_none", "none")
-# decodeDNA("dna-encodings/bad_apple.mp4_med_encoding.txt", "decoded-videos/bad_apple_med_none", "none")
-# decodeDNA("dna-encodings/bad_apple.mp4_low_encoding.txt", "decoded-videos/bad_apple_low_none", "none")
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_none", "none")
-
-# decodeDNA("dna-encodings/food.mp4_high_encoding.txt", "decoded-videos/food_high_none", "none")
-# decodeDNA("dna-encodings/food.mp4_med_encoding.txt", "decoded-videos/food_med_none", "none")
-# decodeDNA("dna-encodings/food.mp4_low_encoding.txt", "decoded-videos/food_low_none", "none")
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_none", "none")
-
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_recessive", "recessive")
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle", "sickle")
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle1", "sickle1")
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle2", "sickle2")
-# decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_rip", "rip")
-decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_cancer", "cancer")
-
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_recessive", "recessive")
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle", "sickle")
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle1", "sickle1")
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle2", "sickle2")
-# decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_rip", "rip")
-decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_cancer", "cancer")
+# Many mutations from one decode
+# mutations that read the tokens the same way (all but the sickles) share the reading of the strand,
+# each of them only puts its own frames together, from its own previous frame
+# the sickles change how tokens are read (and where frames end), so every different sickle change
+# reads the strand on its own, alongside the others
+def parseGroups(mutationList):
+    groups = {}
+    for mutation in mutationList:
+        mutationClass = mutationType(mutation)
+        groups.setdefault((mutationClass.lengthensRuns, mutationClass.rewritesLiterals), []).append(mutation)
+    return list(groups.values())
+
+
+# videos are written to outputPath_mutation.avi, the same as decodeDNA with the same seed would write
+# with a cache only the mutations not in it are decoded
+# returns {mutation: video path}
+def decodeDNAMutations(encodedFile, outputPath, mutationList=tuple(mutations), workers=1, seed=None, pipelineDepth=0,
+                       cache=None):
+    if cache is not None:
+        keys = {mutation: decodeKey(encodedFile, mutation, seed) for mutation in mutationList}
+        missing = []
+        for mutation in mutationList:
+            if keys[mutation] is not None and cache.get(keys[mutation], {'video': f'{outputPath}_{mutation}.avi'}):
+                print(f"Decoding found in cache. Video at {outputPath}_{mutation}.avi")
+            else:
+                missing.append(mutation)
+        if missing:
+            decodeDNAMutations(encodedFile, outputPath, missing, workers, seed, pipelineDepth)
+        for mutation in missing:
+            if keys[mutation] is not None:
+                cache.put(keys[mutation], {'video': f'{outputPath}_{mutation}.avi'})
+        return {mutation: f'{outputPath}_{mutation}.avi' for mutation in mutationList}
+    outputPaths = {}
+    # closed in reverse: the frames stop being read, writer threads finish, then the videos and strands are closed
+    with contextlib.ExitStack() as stack:
+        groups = []
+        for group in parseGroups(mutationList):
+            strand = stack.enter_context(openStrand(encodedFile))
+            header = readHeader(strand)
+            mutationClass = mutationType(group[0])
+            if workers > 1:
+                frames = parallelFrameTokens(strand, header, mutationClass, 0, header.size, workers, 16,
+                                             readIndex(encodedFile))
+            else:
+                frames = frameTokens(strand, header, mutationClass, 0, header.size)
+            if pipelineDepth:
+                frames = threaded(frames, pipelineDepth)
+            outputs = []
+            for mutation in group:
+                outputPaths[mutation] = f'{outputPath}_{mutation}.avi'
+                vid = cv2.VideoWriter(outputPaths[mutation], cv2.VideoWriter_fourcc(*'MJPG'), float(header.fps),
+                                      (header.width, header.height))
+                stack.callback(vid.release)
+                write = stack.enter_context(ThreadedWriter(vid.write, pipelineDepth)).put if pipelineDepth else vid.write
+                outputs.append((FrameDecoder(header, mutation, seed), write))
+            stack.callback(frames.close)
+            groups.append((frames, outputs))
+
+        frameCount = 0
+        while groups:
+            reading = []
+            for frames, outputs in groups:
+                tokens = next(frames, None)
+                if tokens is None:
+                    continue
+                keyframe, start, end, done, runs, literalPixels, colors = tokens
+                for decoder, write in outputs:
+                    frame = decoder.decode(keyframe, done, literalPixels, colors)
+                    # frames are reused by the decoders, so writer threads get their own copy
+                    write(frame.copy() if pipelineDepth else frame)
+                reading.append((frames, outputs))
+            groups = reading
+            if not groups:
+                break
+            frameCount += 1
+            if frameCount % 10 == 0:
+                print(f"Wrote frame {frameCount}")
+    for mutation in mutationList:
+        print(f"All frames completed! Video at {outputPaths[mutation]}")
+    return outputPaths
+
+
+if __name__ == '__main__':
+    # decodeDNA("dna-encodings/bad_apple.mp4_high_encoding.txt", "decoded-videos/bad_apple_high_none", "none")
+    # decodeDNA("dna-encodings/bad_apple.mp4_med_encoding.txt", "decoded-videos/bad_apple_med_none", "none")
+    # decodeDNA("dna-encodings/bad_apple.mp4_low_encoding.txt", "decoded-videos/bad_apple_low_none", "none")
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_none", "none")
+
+    # decodeDNA("dna-encodings/food.mp4_high_encoding.txt", "decoded-videos/food_high_none", "none")
+    # decodeDNA("dna-encodings/food.mp4_med_encoding.txt", "decoded-videos/food_med_none", "none")
+    # decodeDNA("dna-encodings/food.mp4_low_encoding.txt", "decoded-videos/food_low_none", "none")
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_none", "none")
+
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_recessive", "recessive")
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle", "sickle")
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle1", "sickle1")
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_sickle2", "sickle2")
+    # decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_rip", "rip")
+    decodeDNA("dna-encodings/bad_apple.mp4_none_encoding.txt", "decoded-videos/bad_apple_none_cancer", "cancer")
+
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_recessive", "recessive")
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle", "sickle")
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle1", "sickle1")
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_sickle2", "sickle2")
+    # decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_rip", "rip")
+    decodeDNA("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none_cancer", "cancer")
+
+    # every mutation from one decode, decoded-videos/food_none_<mutation>.avi
+    # decodeDNAMutations("dna-encodings/food.mp4_none_encoding.txt", "decoded-videos/food_none")
@@ -1,43 +1,110 @@
 # taking frames from a video then using 'A', 'T', 'C', and 'G' to redraw them
-# deciding which base based on luminance 
+# deciding which base based on luminance
 # luminance = 0.2126r + 0.7152g + 0.0722b   https://www.itu.int/dms_pubrec/itu-r/rec/bt/R-REC-BT.709-6-201506-I!!PDF-E.pdf
 # 'T' = 0-60
 # 'C' = 60-125
 # 'A' = 125-190
 # 'G' = 190-255
+# the whole frame is drawn at once: luminance of every pixel, a level (0-3) from the thresholds,
+# then the letters from one lookup and the frame's text as a single bytes
+# output options:
+#   width - draws the frame that many letters wide (the video is shrunk first), letters are about
+#           twice as tall as they are wide so the rows are halved too (charAspect)
+#   fps - plays at that many frames per second ('video' = the video's own fps), frames are skipped when drawing falls behind
+#   redraw - after the first frame only the letters that changed are drawn, with ANSI cursor moves
 
+import sys
+import time
 import numpy as np
 import cv2
 
 
-def drawWithDna(inputName):
-    # getting original video info
-    cap = cv2.VideoCapture(inputName)
+letters = np.frombuffer(b'TCAG', dtype=np.uint8)
+thresholds = np.array([60, 125, 190])
+
+
+# frame --> level of every pixel (0 = T ... 3 = G)
+def dnaLevels(frame, width=None, charAspect=0.5):
+    if width is not None:
+        height = max(1, round(frame.shape[0] * width / frame.shape[1] * charAspect))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    # (the channels are weighted in the order they are read, as the drawings always were)
+    luminance = 0.2126 * frame[:, :, 0] + 0.7152 * frame[:, :, 1] + 0.0722 * frame[:, :, 2]
+    return np.searchsorted(thresholds, luminance, side='left').astype(np.uint8)
+
+
+# levels --> the frame's text, one line per row
+def dnaText(levels):
+    rows = np.empty((levels.shape[0], levels.shape[1] + 1), dtype=np.uint8)
+    rows[:, :-1] = letters[levels]
+    rows[:, -1] = ord('\n')
+    return rows.tobytes()
+
+
+# only the letters that changed: a cursor move to every stretch of changed letters in a row, then the stretch
+def changedText(levels, prevLevels):
+    height, width = levels.shape
+    # a column of False on both sides so no stretch goes over the end of a row
+    changed = np.zeros((height, width + 2), dtype=bool)
+    changed[:, 1:-1] = levels != prevLevels
+    edges = np.flatnonzero(changed.ravel()[1:] != changed.ravel()[:-1]) + 1
+    starts, ends = edges[0::2], edges[1::2]
+    rows, cols = starts // (width + 2), starts % (width + 2) - 1
+    text = letters[levels]
+    return b''.join(b'\x1b[%d;%dH' % (row + 1, col + 1) + text[row, col:col + end - start].tobytes()
+                    for row, col, start, end in zip(rows.tolist(), cols.tolist(), starts.tolist(), ends.tolist()))
 
+
+# draws any frames (like iterFrames from decoding.py), see drawWithDna for the options
+def drawFrames(frames, width=None, fps=None, redraw=False, out=None):
+    out = out or sys.stdout.buffer
+    prevLevels = None
+    frameTime = 1 / fps if fps else 0
+    started = time.perf_counter()
+    for k, frame in enumerate(frames):
+        if frameTime:
+            late = time.perf_counter() - (started + k * frameTime)
+            if late > frameTime:
+                continue
+            if late < 0:
+                time.sleep(-late)
+        levels = dnaLevels(frame, width)
+        if not redraw:
+            out.write(dnaText(levels) + b'\n')
+        elif prevLevels is None or prevLevels.shape != levels.shape:
+            # clear the screen, draw the whole frame from the top left
+            out.write(b'\x1b[2J\x1b[H' + dnaText(levels))
+        else:
+            out.write(changedText(levels, prevLevels))
+        out.flush()
+        prevLevels = levels
+    if redraw and prevLevels is not None:
+        # cursor back under the drawing
+        out.write(b'\x1b[%d;1H' % (prevLevels.shape[0] + 1))
+        out.flush()
+
+
+def readFrames(cap):
     while True:
         ret, frame = cap.read()
         if not ret:
-            break
-        newFrame = ""
-        for row in frame:
-            for pixel in row:
-                luminance = 0.2126 * pixel[0] + 0.7152 * pixel[1] + 0.0722 * pixel[2]
-                if luminance > 190:
-                    newFrame += 'G'
-                elif luminance > 125:
-                    newFrame += 'A'
-                elif luminance > 60:
-                    newFrame += 'C'
-                else:
-                    newFrame += 'T'
-            newFrame += '\n'
-        print(newFrame)
-    
+            return
+        yield frame
+
+
+def drawWithDna(inputName, width=None, fps=None, redraw=False):
+    # getting original video info
+    cap = cv2.VideoCapture(inputName)
+    if fps == 'video':
+        fps = cap.get(cv2.CAP_PROP_FPS)
+    drawFrames(readFrames(cap), width, fps, redraw)
     cap.release()
     return
 
 # print(drawWithDna('original-videos/food.mp4'))
 # print(drawWithDna('original-videos/bad_apple.mp4'))
+# playing in the terminal as it is drawn, 120 letters wide:
+# drawWithDna('original-videos/bad_apple.mp4', width=120, fps='video', redraw=True)
 
 # ffmpeg -i 'food_terminal.mov' -filter:v "setpts=PTS/33" -an "food_dna_drawing.mp4"
-# ffmpeg -i 'bad_apple_terminal.mov' -filter:v "setpts=PTS/5.6" -an "bad_apple_dna_drawing.mp4"
\ No newline at end of file
+# ffmpeg -i 'bad_apple_terminal.mov' -filter:v "setpts=PTS/5.6" -an "bad_apple_dna_drawing.mp4"
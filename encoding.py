@@ -19,10 +19,20 @@
 #       return DNA 
 ###
 
-import random
 import numpy as np
 import cv2
+import contextlib
+import heapq
 import os
+import time
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from cache import cacheKey
+from pipeline import ThreadedWriter, threaded
+from strand import (ColorTable, canonicalCodes, entropyVersion, formatVersion, indexPath, keyframeVersion, longRunVersion,
+                    maxCodeLength, maxKeyframeInterval, maxTileSize, strandWriter, tileCount, tileOrder, tileVersion,
+                    writeIndex)
 
 
 # Encoding schemes
@@ -44,13 +54,25 @@ def toBases(num, pad):
         encodedNum += encodingDict[int(n)]
     return encodedNum
 
+# base codes used by the vectorized encoder, A = 0, T = 1, C = 2, G = 3
+# (same order as encodingDict, so codes and letters convert with a lookup)
+baseLetters = np.frombuffer(b'ATCG', dtype=np.uint8)
+baseCodes = np.zeros(256, dtype=np.uint8)
+baseCodes[baseLetters] = np.arange(4, dtype=np.uint8)
+
+def basesToCodes(bases):
+    return baseCodes[np.frombuffer(bases.encode('ascii'), dtype=np.uint8)]
+
+codeLetters = bytes.maketrans(bytes(range(4)), b'ATCG')
+
+def codesToBases(codes):
+    return codes.tobytes().translate(codeLetters).decode('ascii')
+
 # High (black and white)
     # for 0 choose at random A or C
     # for 255 choose at random T or G
-def highEncoding(color):
-    if color == 0:
-        return random.choice(['A', 'C'])
-    return random.choice(['T', 'G'])
+# row 0 is used for black, row 1 for white, the column is the coin flip
+highCodeTable = basesToCodes('ACTG').reshape(2, 2)
 
 # Medium (0, 50, 100, 150, 200, 250)
 medEncoding = {
@@ -75,129 +97,638 @@ lowEncodingTable = {i: toBases(i / 5, 3) for i in range(0, 256, 5)}
 # toBases(num, 4)
 noneEncodingTable = {i: toBases(i, 4) for i in range(0, 256)}
 
+# lookup tables for whole frames: color --> codes of its bases
+# (only posterized colors ever get looked up, the other rows stay A's)
+# the codes of a color are packed into one item so a lookup copies them all at once
+def codeTable(encodingTable, pad):
+    table = np.zeros((256, pad), dtype=np.uint8)
+    for color, bases in encodingTable.items():
+        table[color] = basesToCodes(bases)
+    return table.view(f'V{pad}').ravel()
+
+medCodeTable = codeTable(medEncoding, 2)
+lowCodeTable = codeTable(lowEncodingTable, 3)
+noneCodeTable = codeTable(noneEncodingTable, 4)
+
+# run lengths 0-15 --> 2 bases
+maxRunLength = 15
+runCodeTable = np.array([basesToCodes(toBases(i, 2)) for i in range(maxRunLength + 1)])
+
+# number of bases for a pixel's colors
+literalWidth = {'high': 1, 'med': 6, 'low': 9, 'none': 12}
+
 
 # posterization
     # high: rounding to 0, 255
     # medium rounding to 50's
     # low rounding to 5's
+highPosterizationTable = ((np.arange(0, 256) >= 127) * 255).astype(np.uint8)
 medPosterizationTable = (np.round(np.arange(0, 256) / 50) * 50).astype(np.uint8)
 lowPosterizationTable = (np.round(np.arange(0, 256) / 5) * 5).astype(np.uint8)
 
+def posterize(frame, posterization):
+    if posterization == 'high':
+        return cv2.LUT(frame, highPosterizationTable)
+    elif posterization == 'med':
+        return cv2.LUT(frame, medPosterizationTable)
+    elif posterization == 'low':
+        return cv2.LUT(frame, lowPosterizationTable)
+    return frame
+
+
+# the frame as a strand of that posterization decodes it
+# (high only keeps the first color, the decoder puts it in all three)
+def posterizedFrame(frame, posterization):
+    posterized = posterize(frame, posterization)
+    if posterization == 'high':
+        return np.repeat(posterized[:, :, :1], 3, axis=2)
+    return posterized
+
+
+# random source for the A/C and T/G choice of high posterization
+rng = np.random.default_rng()
+
+
+# forked worker processes would all start from a copy of the same rng (and make the same choices)
+def seedWorker():
+    global rng
+    rng = np.random.default_rng()
+
+
+# codes for the colors of every pixel in pixels (n x 3), one row per pixel
+def literalCodes(pixels, posterization):
+    if posterization == 'high':
+        # only the first color decides black or white
+        white = (pixels[:, 0] != 0).astype(np.uint8)
+        return highCodeTable[white, rng.integers(0, 2, len(pixels))].reshape(-1, 1)
+    elif posterization == 'med':
+        table = medCodeTable
+    elif posterization == 'low':
+        table = lowCodeTable
+    else:
+        table = noneCodeTable
+    return table[pixels].view(np.uint8).reshape(len(pixels), 3 * table.itemsize)
+
+
+# finding the runs of a frame
+    # samePixels is flat, True where the pixel matches the previous frame
+# start and length of every stretch of same pixels
+def findStretches(samePixels):
+    padded = np.concatenate(([False], samePixels, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    stretchStarts = edges[0::2]
+    return stretchStarts, edges[1::2] - stretchStarts
+
+
+# stretches cut into runs of at most maxLength
+def cutStretches(stretchStarts, stretchLengths, maxLength):
+    runsPerStretch = (stretchLengths + maxLength - 1) // maxLength
+    firstRun = np.cumsum(runsPerStretch) - runsPerStretch
+    runIndex = np.arange(runsPerStretch.sum()) - np.repeat(firstRun, runsPerStretch)
+    runStarts = np.repeat(stretchStarts, runsPerStretch) + runIndex * maxLength
+    runLengths = np.minimum(np.repeat(stretchLengths, runsPerStretch) - runIndex * maxLength, maxLength)
+    return runStarts, runLengths
+
+
+# G runs: every stretch of same pixels is cut into runs of at most 15
+# the last pixel of the frame always starts its own token
+# returns the pixel each run starts at and its length
+def findRuns(samePixels):
+    last = len(samePixels) - 1
+    runStarts, runLengths = cutStretches(*findStretches(samePixels[:last]), maxRunLength)
+    if last >= 0 and samePixels[last]:
+        runStarts = np.append(runStarts, last)
+        runLengths = np.append(runLengths, 1)
+    return runStarts, runLengths
+
+
+# version 2 runs: runs of up to 15 stay G + 2 bases, longer ones are A + 1 base n + 3 * (n + 1) bases,
+# and a stretch reaching the end of the frame is a single T
+maxLongRunLength = 4 ** 12 - 1
+
+# returns the runs, and the pixel the T starts at (the frame size if there is none)
+def findLongRuns(samePixels):
+    stretchStarts, stretchLengths = findStretches(samePixels)
+    rest = len(samePixels)
+    if len(stretchStarts) and stretchStarts[-1] + stretchLengths[-1] == rest:
+        rest = stretchStarts[-1]
+        stretchStarts, stretchLengths = stretchStarts[:-1], stretchLengths[:-1]
+    runStarts, runLengths = cutStretches(stretchStarts, stretchLengths, maxLongRunLength)
+    return runStarts, runLengths, rest
+
+
+# bases in the long run token of every length (A, n, then n + 1 groups of 3 digits)
+def longRunSizes(runLengths):
+    digitGroups = (runLengths >= 4 ** 3).astype(np.uint8) + (runLengths >= 4 ** 6) + (runLengths >= 4 ** 9)
+    return digitGroups, 2 + 3 * (digitGroups + 1)
+
+
+# codes of the long run tokens, one row each (only the first tokenSize codes of a row are used)
+def longRunCodes(runLengths):
+    digitGroups, tokenSize = longRunSizes(runLengths)
+    # the 12 digits of every length, then the last 3 * (n + 1) of them go after the A and n
+    digits = ((runLengths[:, None] >> np.arange(22, -1, -2)) & 3).astype(np.uint8)
+    columns = np.arange(14)
+    rows, cols = np.nonzero((columns >= 2) & (columns < tokenSize[:, None]))
+    codes = np.zeros((len(runLengths), 14), dtype=np.uint8)
+    codes[:, 1] = digitGroups
+    codes[rows, cols] = digits[rows, cols + 12 - tokenSize[rows]]
+    return codes, tokenSize
+
+
+# Color tables (format version 4)
+# the literal colors of the first frames are counted, the most used get the shortest codes
+# colors left out of the table (rarer ones, or ones that only show up later) are written
+# after the escape code, the same as a plain literal
+maxColors = 4 ** 6 - 1
+
+# literal codes --> one number per color
+def colorKeys(codes):
+    return codes.astype(np.int64) @ (4 ** np.arange(codes.shape[1] - 1, -1, -1, dtype=np.int64))
+
+
+# quaternary Huffman: the 4 least used are merged until one is left, every merge adds a base to their codes
+# (unused symbols pad the count so every merge takes 4)
+def huffmanLengths(counts):
+    if len(counts) == 1:
+        return [1]
+    heap = [(count, symbol, [symbol]) for symbol, count in enumerate(counts)]
+    heap += [(0, len(counts) + k, []) for k in range((1 - len(counts)) % 3)]
+    heapq.heapify(heap)
+    lengths = [0] * len(counts)
+    merges = len(heap)
+    while len(heap) > 1:
+        merged = [heapq.heappop(heap) for k in range(4)]
+        symbols = [symbol for count, order, group in merged for symbol in group]
+        for symbol in symbols:
+            lengths[symbol] += 1
+        heapq.heappush(heap, (sum(count for count, order, group in merged), merges, symbols))
+        merges += 1
+    return lengths
+
+
+# colors are dropped from the table until no code is longer than maxCodeLength
+# returns None if the codes (and the table) would take more bases than plain literals for the counted colors
+def buildColorTable(keys, counts, posterization):
+    order = np.argsort(-counts, kind='stable')
+    keys, counts = keys[order], counts[order]
+    colorCount = min(len(keys), maxColors)
+    while True:
+        escapeCount = int(counts[colorCount:].sum()) + 1
+        lengths = huffmanLengths([escapeCount] + counts[:colorCount].tolist())
+        if max(lengths) <= maxCodeLength:
+            break
+        colorCount //= 2
+    width = literalWidth[posterization]
+    codedBases = (int(counts[:colorCount] @ np.array(lengths[1:], dtype=np.int64)) + (escapeCount - 1) * (lengths[0] + width)
+                  + colorCount * (2 + width))
+    if codedBases >= int(counts.sum()) * width:
+        return None
+    colors = ((keys[:colorCount, None] >> (2 * np.arange(width - 1, -1, -1))) & 3).astype(np.uint8)
+    return ColorTable(lengths[0], bytes(lengths[1:]), colors.tobytes())
+
+
+# counts the colors of the changed pixels in the first frames of the video
+# returns {posterization: color table (None where plain literals are smaller)}
+def sampleColorTables(videoPath, posterizations, tableFrames=30):
+    cap = cv2.VideoCapture(videoPath)
+    prevFrames = {}
+    keys = {posterization: [] for posterization in posterizations}
+    for k in range(tableFrames + 1):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        for posterization in posterizations:
+            posterized = posterize(frame, posterization)
+            if posterization in prevFrames:
+                changed = np.any(posterized != prevFrames[posterization], axis=2).ravel()
+                pixels = posterized.reshape(-1, 3)[changed]
+                keys[posterization].append(colorKeys(literalCodes(pixels, posterization)))
+            prevFrames[posterization] = posterized
+    cap.release()
+    colorTables = {}
+    for posterization in posterizations:
+        allKeys = np.concatenate(keys[posterization]) if keys[posterization] else np.empty(0, dtype=np.int64)
+        colorTables[posterization] = buildColorTable(*np.unique(allKeys, return_counts=True), posterization)
+    return colorTables
+
+
+# what the encoder needs of a table: the table's colors sorted by key, their symbols,
+# and the bases and length of every symbol's code
+@lru_cache(maxsize=8)
+def colorEncoder(colorTable, posterization):
+    width = literalWidth[posterization]
+    lengths = np.array([colorTable.escapeLength] + list(colorTable.lengths), dtype=np.uint8)
+    values = np.array(canonicalCodes(lengths), dtype=np.int64)
+    # codes are left aligned, the bases after the code's length are not written
+    shifts = 2 * (lengths[:, None].astype(np.int64) - 1 - np.arange(maxCodeLength))
+    codeBases = ((values[:, None] >> np.maximum(shifts, 0)) & 3).astype(np.uint8)
+    codeBases[shifts < 0] = 0
+    keys = colorKeys(np.frombuffer(colorTable.colors, dtype=np.uint8).reshape(-1, width))
+    order = np.argsort(keys)
+    return keys[order], (order + 1).astype(np.int64), codeBases, lengths
+
+
+# the symbol of every literal's color (0 = the escape code, for colors not in the table)
+def colorSymbols(colors, colorTable, posterization):
+    keys = colorKeys(colors)
+    tableKeys, tableSymbols, codeBases, codeLengths = colorEncoder(colorTable, posterization)
+    at = np.minimum(np.searchsorted(tableKeys, keys), max(len(tableKeys) - 1, 0))
+    symbols = np.zeros(len(keys), dtype=np.int64)
+    if len(tableKeys):
+        found = tableKeys[at] == keys
+        symbols[found] = tableSymbols[at[found]]
+    return symbols
+
+
+# Finding the tokens
+# where the tokens of a frame (after the first) go, from which pixels changed
+# tileSize (version 3) leaves out the pixels of unchanged tiles and makes the tile map
+# returns the tile map, the pixels written (in order) and which of them are unchanged,
+# the pixel every token starts at, which tokens are runs, the run lengths,
+# and the pixel the T starts at (the number of pixels written if there is none)
+def planTokens(frame, prevFrame, longRuns=False, tileSize=0):
+    allPixels = frame.reshape(-1, 3)
+    blue, green, red = cv2.split(cv2.absdiff(frame, prevFrame))
+    samePixels = ((blue | green | red) == 0).ravel()
+    tileMap = np.empty(0, dtype=np.uint8)
+    if tileSize:
+        # G for unchanged tiles, C for changed ones, T after the last changed tile
+        height, width = frame.shape[:2]
+        order, tiles = tileOrder(width, height, tileSize)
+        samePixels = samePixels[order]
+        changedTiles = np.bincount(tiles[~samePixels], minlength=tileCount(width, height, tileSize)) > 0
+        changedAt = np.flatnonzero(changedTiles)
+        tileMap = np.where(changedTiles, 2, 3).astype(np.uint8)
+        mapEnd = changedAt[-1] + 1 if len(changedAt) else 0
+        if mapEnd < len(tileMap):
+            tileMap = np.append(tileMap[:mapEnd], np.uint8(1))
+        # only the pixels of the changed tiles are written, in tile order
+        inChangedTile = changedTiles[tiles]
+        samePixels = samePixels[inChangedTile]
+        allPixels = allPixels[order[inChangedTile]]
+    if longRuns:
+        runStarts, runLengths, rest = findLongRuns(samePixels)
+    else:
+        runStarts, runLengths = findRuns(samePixels)
+        rest = len(samePixels)
+    # a token starts at every changed pixel and at every run start
+    isStart = ~samePixels
+    isStart[runStarts] = True
+    isStart[rest:] = False
+    starts = np.flatnonzero(isStart)
+    isRun = samePixels[starts]
+    return tileMap, allPixels, samePixels, starts, isRun, runLengths, rest
+
 
 # Encoding
 # A = 0, T = 1, C = 2, G = 3
+# works on the whole frame at once, returns the codes of the frame's bases
+# longRuns uses the version 2 runs (see findLongRuns)
+# stats (a dict) gets the time of every stage and the frame's counters, see metrics.py
+# tileSize (version 3, with longRuns) writes the tile map first and then only the pixels of changed tiles, see tileOrder
+# colorTable (version 4, with longRuns) writes the literals with the table's codes, see buildColorTable
+def encodeFrameCodes(frame, prevFrame, posterization, longRuns=False, stats=None, tileSize=0, colorTable=None):
+    start = time.perf_counter()
+    frame = posterize(frame, posterization)
+    posterized = time.perf_counter()
+    allPixels = frame.reshape(-1, 3)
+    # first frame: every pixel written out
+    if prevFrame is None:
+        codes = literalCodes(allPixels, posterization).ravel()
+        if stats is not None:
+            stats.update(posterize=posterized - start, changes=0.0, emit=time.perf_counter() - posterized,
+                         runTokens=0, literalTokens=len(allPixels), changedPixels=len(allPixels), pixels=len(allPixels))
+        return codes, frame
+    frameSize = len(allPixels)
+    tileMap, allPixels, samePixels, starts, isRun, runLengths, rest = planTokens(frame, prevFrame, longRuns, tileSize)
+    runRows = np.flatnonzero(isRun)
+    changedRows = np.flatnonzero(~isRun)
+    changesFound = time.perf_counter()
+    # one row per token, G + 2 bases for runs, C + the colors for changed pixels
+    width = literalWidth[posterization]
+    rowWidth = 1 + width if colorTable is None else 1 + colorTable.escapeLength + width
+    tokens = np.empty((len(starts) + 1, max(14 if longRuns else 3, rowWidth)), dtype=np.uint8)
+    tokenSize = np.where(isRun, 3, 1 + width).astype(np.uint8)
+    # run length encoding
+    tokens[runRows, 0] = 3
+    tokens[runRows, 1:3] = runCodeTable[np.minimum(runLengths, maxRunLength)]
+    if longRuns:
+        longRows = runRows[runLengths > maxRunLength]
+        tokens[longRows, :14], tokenSize[longRows] = longRunCodes(runLengths[runLengths > maxRunLength])
+    # changes from the previous frame
+    tokens[changedRows, 0] = 2
+    if colorTable is None:
+        tokens[changedRows, 1:1 + width] = literalCodes(allPixels[starts[changedRows]], posterization)
+    else:
+        # C + the color's code, or C + the escape code + the colors
+        colors = literalCodes(allPixels[starts[changedRows]], posterization)
+        symbols = colorSymbols(colors, colorTable, posterization)
+        tableKeys, tableSymbols, codeBases, codeLengths = colorEncoder(colorTable, posterization)
+        tokens[changedRows, 1:1 + maxCodeLength] = codeBases[symbols]
+        escaped = symbols == 0
+        escapeStart = 1 + colorTable.escapeLength
+        tokens[changedRows[escaped], escapeStart:escapeStart + width] = colors[escaped]
+        tokenSize[changedRows] = 1 + codeLengths[symbols] + width * escaped
+    # the rest of the frame unchanged
+    tokens[-1, 0] = 1
+    tokenSize = np.append(tokenSize, 1 if rest < len(samePixels) else 0).astype(np.uint8)
+    # keeping only the used part of each row, in pixel order
+    codes = tokens[np.arange(tokens.shape[1], dtype=np.uint8) < tokenSize[:, None]]
+    if tileSize:
+        codes = np.concatenate((tileMap, codes))
+    if stats is not None:
+        stats.update(posterize=posterized - start, changes=changesFound - posterized, emit=time.perf_counter() - changesFound,
+                     runTokens=len(runRows) + int(rest < len(samePixels)), literalTokens=len(changedRows),
+                     changedPixels=len(changedRows), pixels=frameSize)
+    return codes, frame
+
+
 def encodeFrames(frame, prevFrame, posterization):
-    # posterization
+    encodedFrame, frame = encodeFrameCodes(frame, prevFrame, posterization)
+    return codesToBases(encodedFrame), frame
+
+
+# Encoding many frames
+# a frame only needs the previous frame, so stretches of frames can be encoded anywhere
+# as long as they come with the frame before them (as read, it is posterized here)
+# keyframes are the frames encoded without a previous frame
+# returns (codes, stats) for every frame, stats is None without withStats
+def encodeBatch(frames, prevFrame, keyframes, posterization, longRuns=False, withStats=False, tileSize=0, colorTable=None):
+    if prevFrame is not None:
+        prevFrame = posterize(prevFrame, posterization)
+    encodedFrames = []
+    for frame, keyframe in zip(frames, keyframes):
+        stats = {} if withStats else None
+        encodedFrame, prevFrame = encodeFrameCodes(frame, None if keyframe else prevFrame, posterization, longRuns, stats,
+                                                   tileSize, colorTable)
+        encodedFrames.append((encodedFrame, stats))
+    return encodedFrames
+
+
+# frames of the video in batches, each with the frame before it and which frames are keyframes
+def readBatches(cap, keyframeInterval, batchSize, metrics=None):
+    prevFrame = None
+    i = 0
+    while True:
+        frames = []
+        while len(frames) < batchSize:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if metrics is not None:
+                metrics.add('read', time.perf_counter() - start)
+            if not ret:
+                break
+            frames.append(frame)
+        if not frames:
+            return
+        keyframes = [(i + k) % keyframeInterval == 0 if keyframeInterval else i + k == 0 for k in range(len(frames))]
+        yield frames, prevFrame, keyframes
+        prevFrame = frames[-1]
+        i += len(frames)
+
+
+# the same frames encoded with every posterization, one list of (codes, stats) per posterization
+# colorTables has the color table of every posterization (or None)
+def encodeBatchLevels(frames, prevFrame, keyframes, posterizations, longRuns=False, withStats=False, tileSize=0,
+                      colorTables=None):
+    colorTables = colorTables or [None] * len(posterizations)
+    return [encodeBatch(frames, prevFrame, keyframes, posterization, longRuns, withStats, tileSize, colorTable)
+            for posterization, colorTable in zip(posterizations, colorTables)]
+
+
+# yields, for every frame of the video in order, a (codes, stats) per posterization (stats only with metrics)
+# with more than one worker, batches of frames are encoded in a process pool, with at most
+# maxInFlight frames read but not yet written, so memory stays bounded on long videos
+# (batches are made smaller when maxInFlight is too small for a batch for every worker)
+# with a pipelineDepth, frames are read in their own thread, at most pipelineDepth batches ahead
+batchSize = 8
+
+def encodeVideoLevels(cap, posterizations, keyframeInterval=0, workers=1, maxInFlight=64, longRuns=False, metrics=None,
+                      pipelineDepth=0, tileSize=0, colorTables=None):
+    withStats = metrics is not None
+    size = batchSize if workers <= 1 else max(1, min(batchSize, maxInFlight // workers))
+    batches = readBatches(cap, keyframeInterval, size, metrics)
+    if pipelineDepth:
+        batches = threaded(batches, pipelineDepth)
+    if workers <= 1:
+        for frames, prevFrame, keyframes in batches:
+            yield from zip(*encodeBatchLevels(frames, prevFrame, keyframes, posterizations, longRuns, withStats, tileSize,
+                                              colorTables))
+        return
+    with ProcessPoolExecutor(workers, initializer=seedWorker) as pool:
+        pending = deque()
+        for frames, prevFrame, keyframes in batches:
+            pending.append(pool.submit(encodeBatchLevels, frames, prevFrame, keyframes, posterizations, longRuns, withStats,
+                                       tileSize, colorTables))
+            # room for the next batch to be read
+            while pending and (len(pending) + 1) * size > maxInFlight:
+                yield from zip(*pending.popleft().result())
+        while pending:
+            yield from zip(*pending.popleft().result())
+
+
+# yields (codes, stats) for every frame of the video, in order, see encodeVideoLevels
+def encodeVideo(cap, posterization, keyframeInterval=0, workers=1, maxInFlight=64, longRuns=False, metrics=None,
+                pipelineDepth=0, tileSize=0, colorTable=None):
+    for encodedFrames in encodeVideoLevels(cap, [posterization], keyframeInterval, workers, maxInFlight, longRuns,
+                                           metrics, pipelineDepth, tileSize, [colorTable]):
+        yield encodedFrames[0]
+
+
+# the header has room for keyframe intervals up to maxKeyframeInterval and tiles up to maxTileSize,
+# bigger ones would not fit in their fields and move the rest of the strand
+def checkHeaderFields(keyframeInterval=0, tileSize=0):
+    if not 0 <= keyframeInterval <= maxKeyframeInterval:
+        raise ValueError(f'keyframeInterval must be from 0 to {maxKeyframeInterval}, not {keyframeInterval}')
+    if not 0 <= tileSize <= maxTileSize:
+        raise ValueError(f'tileSize must be from 0 to {maxTileSize}, not {tileSize}')
+
+
+def strandHeader(posterization, fps, width, height, keyframeInterval=0, longRuns=False, tileSize=0, colorTable=None):
+    # 1 base needed to write out which posterization
     if posterization == 'high':
-        frame = ((frame >= 127) * 255)
+        header = 'A'
     elif posterization == 'med':
-        frame = medPosterizationTable[frame].astype(np.uint8)
+        header = 'T'
     elif posterization == 'low':
-        frame = lowPosterizationTable[frame].astype(np.uint8)
-    # encoding
-    encodedFrame = []
-    if prevFrame is not None:
-        samePixels = np.all(frame == prevFrame, axis=2)
-        allPixels = frame.reshape(-1, 3)
-        samePixels = samePixels.flatten()
-        p = 0
-        while p < len(allPixels):
-            # same --> run length encoding
-            if samePixels[p]:
-                runLength = 1
-                # setting max run length to 15, so that only 2 bases are needed to encode it
-                while runLength < 15 and p + runLength < len(allPixels) - 1 and samePixels[p + runLength]:
-                    runLength += 1
-                p += runLength - 1
-                encodedFrame.append('G')
-                encodedFrame.append(toBases(runLength, 2))
-            else:
-                encodedFrame.append('C')
-                pixel = allPixels[p]
-                if posterization == 'high':
-                    encodedFrame.append(highEncoding(pixel[0]))
-                elif posterization == 'med':
-                    encodedFrame.append(medEncoding[pixel[0]])
-                    encodedFrame.append(medEncoding[pixel[1]])
-                    encodedFrame.append(medEncoding[pixel[2]])
-                elif posterization == 'low':
-                    encodedFrame.append(toBases(pixel[0] / 5, 3))
-                    encodedFrame.append(toBases(pixel[1] / 5, 3))
-                    encodedFrame.append(toBases(pixel[2] / 5, 3))
-                else:
-                    encodedFrame.append(toBases(pixel[0], 4))
-                    encodedFrame.append(toBases(pixel[1], 4))
-                    encodedFrame.append(toBases(pixel[2], 4))
-            p += 1
+        header = 'C'
+    else: # No posterization
+        header = 'G'
+    # assuming fps <= 240, we need 4 bases to encode >= 240 (4^4 = 256)
+    # with keyframes, long runs, tiles or a color table the header is versioned: AAAA where the fps would be,
+    # then the version
+    if colorTable is not None:
+        version = entropyVersion
+    elif tileSize:
+        version = tileVersion
+    elif longRuns:
+        version = longRunVersion
+    elif keyframeInterval:
+        version = keyframeVersion
     else:
-        # first frame
-        for pixel in frame.reshape(-1, 3):
-                if posterization == 'high':
-                    encodedFrame.append(highEncoding(pixel[0]))
-                elif posterization == 'med':
-                    encodedFrame.append(medEncoding[pixel[0]])
-                    encodedFrame.append(medEncoding[pixel[1]])
-                    encodedFrame.append(medEncoding[pixel[2]])
-                elif posterization == 'low':
-                    encodedFrame.append(toBases(pixel[0] / 5, 3))
-                    encodedFrame.append(toBases(pixel[1] / 5, 3))
-                    encodedFrame.append(toBases(pixel[2] / 5, 3))
-                else:
-                    encodedFrame.append(toBases(pixel[0], 4))
-                    encodedFrame.append(toBases(pixel[1], 4))
-                    encodedFrame.append(toBases(pixel[2], 4))
-    return ''.join(encodedFrame), frame
-                
-
-# Main function
-def vidToDna(videoPath, posterization='none'):
+        version = 0
+    versioned = version > 0
+    if versioned:
+        header += 'AAAA' + toBases(version, 2)
+    header += toBases(fps, 4)
+    # assuming no videos of resolution greater than 4k, the largest possible frame size is 3840x2160 pixels
+    # in base 4, we need 6 bases to encode >= 3840 (4^6 = 4096)
+    header += toBases(width, 6)
+    header += toBases(height, 6)
+    if versioned:
+        # up to 65535 frames between keyframes
+        header += toBases(keyframeInterval, 8)
+    if version >= tileVersion:
+        # tiles of up to 255 x 255 pixels
+        header += toBases(tileSize, 4)
+    if version >= entropyVersion:
+        # up to 4095 colors, codes of up to maxCodeLength bases
+        lengths = np.frombuffer(colorTable.lengths, dtype=np.uint8)
+        colors = np.frombuffer(colorTable.colors, dtype=np.uint8).reshape(len(lengths), -1)
+        header += toBases(len(lengths), 6) + toBases(colorTable.escapeLength, 2)
+        header += ''.join(toBases(int(length), 2) + codesToBases(color) for length, color in zip(lengths, colors))
+    return header
+
+
+# Main functions
+# packed writes 4 bases per byte (.dna) instead of one letter per base (.txt), see strand.py
+# keyframeInterval writes every interval-th frame out whole (like the first frame), so decoding can
+# start at any keyframe (0 = first frame only, at most maxKeyframeInterval)
+# every strand gets an index of where its frames start (see readIndex in strand.py)
+# workers > 1 encodes in that many processes, see encodeVideo
+# longRuns writes format version 2: runs of any length and one T for the rest of a frame
+# unchanged (a frame the same as the last one is a single base), see findLongRuns
+# metrics (see metrics.py) times every stage, counts tokens and calls its hooks after every frame,
+# in place of the progress printing
+# pipelineDepth > 0 reads the video, encodes and writes the strand at the same time (in threads),
+# with at most pipelineDepth batches/frames waiting between them
+# tileSize (8 or 16 work well, at most maxTileSize) writes format version 3: one base for every tile the same
+# as in the last frame, and only the pixels of changed tiles (with long runs), see tileOrder in strand.py
+# entropy writes format version 4: literal colors get codes by how often they are used in the first
+# tableFrames frames (the table is in the header), see buildColorTable
+# (if the codes would not save bases, like with high, the literals stay plain)
+# cache (see cache.py) copies out a strand already made from the same video with the same options
+# instead of encoding it again, and keeps the strands it does make
+def vidToDna(videoPath, posterization='none', packed=False, keyframeInterval=0, workers=1, maxInFlight=64, longRuns=False,
+             outputDir='dna-encodings', metrics=None, pipelineDepth=0, tileSize=0, entropy=False, tableFrames=30, cache=None):
+    outputPaths = vidToDnaLevels(videoPath, [posterization], packed, keyframeInterval, workers, maxInFlight, longRuns,
+                                 outputDir, metrics, pipelineDepth, tileSize, entropy, tableFrames, cache)
+    return outputPaths[posterization]
+
+
+# the files of a strand, as kept in the cache
+def strandFiles(path):
+    return {'strand': path, 'index': indexPath(path)}
+
+
+# every posterization from a single read of the video (decoding the video is most of the time)
+# every posterization keeps its own previous frame and strand, the same as vidToDna would write
+# metrics get one frame per video frame, with the stages and counters of all posterizations added up
+# with a cache only the posterizations not in it are encoded
+# returns {posterization: strand path}
+def vidToDnaLevels(videoPath, posterizations=('high', 'med', 'low', 'none'), packed=False, keyframeInterval=0, workers=1,
+                   maxInFlight=64, longRuns=False, outputDir='dna-encodings', metrics=None, pipelineDepth=0, tileSize=0,
+                   entropy=False, tableFrames=30, cache=None):
+    checkHeaderFields(keyframeInterval, tileSize)
+    if cache is not None:
+        return cachedLevels(videoPath, list(posterizations), packed, keyframeInterval, workers, maxInFlight, longRuns,
+                            outputDir, metrics, pipelineDepth, tileSize, entropy, tableFrames, cache)
     # get fps, width, and height
     cap = cv2.VideoCapture(videoPath)
     fps = int(cap.get(cv2.CAP_PROP_FPS))
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     frameCount = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    # the pixels of changed tiles and coded colors are written as version 2 tokens
+    longRuns = longRuns or bool(tileSize) or entropy
 
+    if metrics is not None:
+        metrics.start()
     videoName = videoPath.split('/')[-1]
-    with open(f"dna-encodings/{videoName}_{posterization}_encoding.txt", 'w') as f:
-        # 1 base needed to write out which posterization
-        if posterization == 'high':
-            f.write('A')
-        elif posterization == 'med':
-            f.write('T')
-        elif posterization == 'low':
-            f.write('C')
-        else: # No posterization
-            f.write('G')
-        # assuming fps <= 240, we need 4 bases to encode >= 240 (4^4 = 256)
-        f.write(toBases(fps, 4))
-        # assuming no videos of resolution greater than 4k, the largest possible frame size is 3840x2160 pixels
-        # in base 4, we need 6 bases to encode >= 3840 (4^6 = 4096)
-        f.write(toBases(width, 6))
-        f.write(toBases(height, 6))
-
-        prevFrame = None
+    posterizations = list(posterizations)
+    colorTables = [None] * len(posterizations)
+    if entropy:
+        sampled = sampleColorTables(videoPath, posterizations, tableFrames)
+        colorTables = [sampled[posterization] for posterization in posterizations]
+    outputPaths = {posterization: f"{outputDir}/{videoName}_{posterization}_encoding.{'dna' if packed else 'txt'}"
+                   for posterization in posterizations}
+    # closed in reverse: the writer threads finish before their strands are closed
+    with contextlib.ExitStack() as stack:
+        writes = []
+        positions = []
+        for posterization, colorTable in zip(posterizations, colorTables):
+            f = stack.enter_context(strandWriter(outputPaths[posterization], packed))
+            header = strandHeader(posterization, fps, width, height, keyframeInterval, longRuns, tileSize, colorTable)
+            f.write(basesToCodes(header))
+            positions.append(len(header))
+            writes.append(stack.enter_context(ThreadedWriter(f.write, pipelineDepth)).put if pipelineDepth else f.write)
+
+        frameStarts = [[] for posterization in posterizations]
         i = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            encodedFrame, prevFrame = encodeFrames(frame, prevFrame, posterization)
-            f.write(encodedFrame)
+        for encodedFrames in encodeVideoLevels(cap, posterizations, keyframeInterval, workers, maxInFlight, longRuns,
+                                               metrics, pipelineDepth, tileSize, colorTables):
+            frameStats = {}
+            for k, (encodedFrame, stats) in enumerate(encodedFrames):
+                frameStarts[k].append((i, positions[k]))
+                start = time.perf_counter()
+                writes[k](encodedFrame)
+                positions[k] += len(encodedFrame)
+                if metrics is not None:
+                    stats.update(write=time.perf_counter() - start, bases=len(encodedFrame))
+                    for name, value in stats.items():
+                        frameStats[name] = frameStats.get(name, 0) + value
+            if metrics is not None:
+                metrics.frame(i, frameStats)
             i += 1
-            if i % 10 == 0:
+            if metrics is None and i % 10 == 0:
                 print(f"Frame {i} / {frameCount} done")
 
     cap.release()
-    print(f'Encoding complete. Find it in dna-encodings/{videoName}_{posterization}_encoding.txt')
+    for k, posterization in enumerate(posterizations):
+        writeIndex(outputPaths[posterization], frameStarts[k])
+    if metrics is not None:
+        metrics.stop()
+    for posterization in posterizations:
+        print(f'Encoding complete. Find it in {outputPaths[posterization]}')
+    return outputPaths
+
+
+# workers, maxInFlight, pipelineDepth and metrics do not change the strand, so they are not part of the key
+def cachedLevels(videoPath, posterizations, packed, keyframeInterval, workers, maxInFlight, longRuns, outputDir, metrics,
+                 pipelineDepth, tileSize, entropy, tableFrames, cache):
+    videoName = videoPath.split('/')[-1]
+    outputPaths = {posterization: f"{outputDir}/{videoName}_{posterization}_encoding.{'dna' if packed else 'txt'}"
+                   for posterization in posterizations}
+    keys = {posterization: cacheKey('encode', videoPath, posterization=posterization, packed=packed,
+                                    keyframeInterval=keyframeInterval, longRuns=longRuns or bool(tileSize) or entropy,
+                                    tileSize=tileSize, entropy=entropy, tableFrames=tableFrames if entropy else 0,
+                                    formatVersion=formatVersion)
+            for posterization in posterizations}
+    missing = []
+    for posterization in posterizations:
+        if cache.get(keys[posterization], strandFiles(outputPaths[posterization])):
+            print(f'Encoding found in cache. Find it in {outputPaths[posterization]}')
+        else:
+            missing.append(posterization)
+    if missing:
+        vidToDnaLevels(videoPath, missing, packed, keyframeInterval, workers, maxInFlight, longRuns, outputDir, metrics,
+                       pipelineDepth, tileSize, entropy, tableFrames)
+        for posterization in missing:
+            cache.put(keys[posterization], strandFiles(outputPaths[posterization]))
+    return outputPaths
+
 
+if __name__ == '__main__':
+    # vidToDna("original-videos/bad_apple.mp4", 'high')
+    # vidToDna("original-videos/bad_apple.mp4", 'med')
+    # vidToDna("original-videos/bad_apple.mp4", 'low')
+    vidToDna("original-videos/bad_apple.mp4")
 
-# vidToDna("original-videos/bad_apple.mp4", 'high')
-# vidToDna("original-videos/bad_apple.mp4", 'med')
-# vidToDna("original-videos/bad_apple.mp4", 'low')
-vidToDna("original-videos/bad_apple.mp4")
+    # vidToDna("original-videos/food.mp4", 'high')
+    # vidToDna("original-videos/food.mp4", 'med')
+    # vidToDna("original-videos/food.mp4", 'low')
+    vidToDna("original-videos/food.mp4")
 
-# vidToDna("original-videos/food.mp4", 'high')
-# vidToDna("original-videos/food.mp4", 'med')
-# vidToDna("original-videos/food.mp4", 'low')
-vidToDna("original-videos/food.mp4")
+    # all four from one read of the video
+    # vidToDnaLevels("original-videos/food.mp4", ['high', 'med', 'low', 'none'])
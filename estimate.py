@@ -0,0 +1,154 @@
+###
+# Estimate:
+#       How big the strands of a video would be, for every posterization, without writing any bases
+#       The video is read once, every posterization keeps its own previous frame (like vidToDnaLevels)
+#       and the tokens of every frame are counted from which pixels changed (see planTokens in encoding.py),
+#       so with every frame the counts are the exact ones vidToDna would write
+#       every=N only counts every Nth frame after the first that is not a keyframe (the frames between are
+#       skipped, not decoded, except the one before a counted frame) and projects the rest from them,
+#       for a quick look at a long video (keyframes are always exact, every pixel is written out, and
+#       are not numbered, so an N that divides the keyframe interval still counts frames)
+#
+#       python estimate.py original-videos/food.mp4                  - every frame, every posterization
+#       python estimate.py original-videos/food.mp4 --every 30 --long-runs --output food-sizes.json
+###
+
+import argparse
+import json
+import cv2
+import numpy as np
+from encoding import (checkHeaderFields, colorEncoder, colorSymbols, literalCodes, literalWidth, longRunSizes,
+                      maxRunLength, planTokens, posterize, sampleColorTables, strandHeader)
+from strand import packedHeader
+
+
+# bases and token counts of a frame after the first, from the frame and the one before it (both posterized)
+def frameCounts(frame, prevFrame, posterization, longRuns=False, tileSize=0, colorTable=None):
+    tileMap, allPixels, samePixels, starts, isRun, runLengths, rest = planTokens(frame, prevFrame, longRuns, tileSize)
+    width = literalWidth[posterization]
+    runBases = 3 * len(runLengths)
+    if longRuns:
+        digitGroups, tokenSize = longRunSizes(runLengths[runLengths > maxRunLength])
+        runBases += int(tokenSize.astype(np.int64).sum()) - 3 * len(tokenSize)
+    changedAt = starts[~isRun]
+    if colorTable is None:
+        literalBases = len(changedAt) * (1 + width)
+    else:
+        symbols = colorSymbols(literalCodes(allPixels[changedAt], posterization), colorTable, posterization)
+        codeLengths = colorEncoder(colorTable, posterization)[3]
+        literalBases = int((1 + codeLengths[symbols].astype(np.int64) + width * (symbols == 0)).sum())
+    restTokens = int(rest < len(samePixels))
+    return {'bases': len(tileMap) + runBases + literalBases + restTokens, 'runTokens': len(runLengths) + restTokens,
+            'literalTokens': len(changedAt), 'changedPixels': len(changedAt)}
+
+
+def keyframeCounts(pixels, posterization):
+    return {'bases': pixels * literalWidth[posterization], 'runTokens': 0, 'literalTokens': pixels, 'changedPixels': pixels}
+
+
+# returns {posterization: estimate}, every estimate has
+#   headerBases, bases (the whole strand), textBytes, packedBytes (the .txt and .dna files)
+#   frames: the counted frames, each with its frame number, keyframe, bases, runTokens, literalTokens, changedPixels
+#   exact: True if every frame was counted, False if the bases are projected
+# the options are the ones of vidToDna (longRuns is on with tiles and entropy, as there)
+def estimateSizes(videoPath, posterizations=('high', 'med', 'low', 'none'), every=1, keyframeInterval=0, longRuns=False,
+                  tileSize=0, entropy=False, tableFrames=30):
+    if every < 1:
+        raise ValueError(f'every must be at least 1, not {every}')
+    checkHeaderFields(keyframeInterval, tileSize)
+    posterizations = list(posterizations)
+    longRuns = longRuns or bool(tileSize) or entropy
+    colorTables = sampleColorTables(videoPath, posterizations, tableFrames) if entropy else {}
+    cap = cv2.VideoCapture(videoPath)
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def isKeyframe(frameNumber):
+        return frameNumber == 0 or (keyframeInterval and frameNumber % keyframeInterval == 0)
+
+    # frames after the first that are not keyframes, numbered from 0 (frame 1 is always counted)
+    def deltaNumber(frameNumber):
+        keyframesBefore = frameNumber // keyframeInterval + 1 if keyframeInterval else 1
+        return frameNumber - keyframesBefore
+
+    def isCounted(frameNumber):
+        return not isKeyframe(frameNumber) and deltaNumber(frameNumber) % every == 0
+
+    frames = {posterization: [] for posterization in posterizations}
+    prevFrames = {}
+    frameNumber = 0
+    while True:
+        # only frames that are counted, or come right before one, are decoded
+        if isCounted(frameNumber) or isCounted(frameNumber + 1):
+            ret, frame = cap.read()
+        else:
+            ret, frame = cap.grab(), None
+        if not ret:
+            break
+        for posterization in posterizations if frame is not None else []:
+            posterized = posterize(frame, posterization)
+            if isCounted(frameNumber):
+                counts = frameCounts(posterized, prevFrames[posterization], posterization, longRuns, tileSize,
+                                     colorTables.get(posterization))
+                frames[posterization].append({'frame': frameNumber, 'keyframe': False, **counts})
+            prevFrames[posterization] = posterized
+        frameNumber += 1
+    cap.release()
+    frameCount = frameNumber
+
+    keyframes = [k for k in range(frameCount) if isKeyframe(k)]
+    estimates = {}
+    for posterization in posterizations:
+        header = strandHeader(posterization, fps, width, height, keyframeInterval, longRuns, tileSize,
+                              colorTables.get(posterization))
+        keyframeBases = len(keyframes) * width * height * literalWidth[posterization]
+        counted = frames[posterization]
+        deltaFrames = frameCount - len(keyframes)
+        deltaBases = sum(counts['bases'] for counts in counted)
+        exact = len(counted) == deltaFrames
+        if counted and not exact:
+            deltaBases = round(deltaBases / len(counted) * deltaFrames)
+        bases = len(header) + keyframeBases + deltaBases
+        counted = sorted(counted + [{'frame': k, 'keyframe': True, **keyframeCounts(width * height, posterization)}
+                                    for k in keyframes], key=lambda counts: counts['frame'])
+        estimates[posterization] = {
+            'headerBases': len(header),
+            'bases': bases,
+            'textBytes': bases,
+            'packedBytes': packedHeader.size + (bases + 3) // 4,
+            'frames': counted,
+            'exact': exact,
+        }
+    return estimates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Strand sizes of a video for every posterization, without encoding it')
+    parser.add_argument('video')
+    parser.add_argument('--output', help='JSON file for the estimates and per-frame counts')
+    parser.add_argument('--posterizations', nargs='+', choices=['high', 'med', 'low', 'none'],
+                        default=['high', 'med', 'low', 'none'])
+    parser.add_argument('--every', type=int, default=1, help='count every Nth frame that is not a keyframe and project the rest')
+    parser.add_argument('--long-runs', action='store_true')
+    parser.add_argument('--keyframe-interval', type=int, default=0)
+    parser.add_argument('--tile-size', type=int, default=0, help='format version 3 tiles (0 = no tiles)')
+    parser.add_argument('--entropy', action='store_true', help='format version 4 color codes')
+    args = parser.parse_args()
+
+    estimates = estimateSizes(args.video, args.posterizations, args.every, args.keyframe_interval, args.long_runs,
+                              args.tile_size, args.entropy)
+    for posterization, estimate in estimates.items():
+        counted = [counts for counts in estimate['frames'] if not counts['keyframe']]
+        print(f"{posterization}: {'' if estimate['exact'] else '~'}{estimate['bases']:,} bases, "
+              f"{estimate['textBytes'] / 2 ** 20:.1f} MB as .txt, {estimate['packedBytes'] / 2 ** 20:.1f} MB as .dna, "
+              f"{np.mean([counts['runTokens'] for counts in counted] or [0]):.0f} runs and "
+              f"{np.mean([counts['literalTokens'] for counts in counted] or [0]):.0f} literals per frame")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(estimates, f, indent=2)
+        print(f'Estimates in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+###
+# Metrics:
+#       Timers, counters and per-frame hooks for vidToDna and decodeDNA
+#           metrics = Metrics(hooks=[printProgress(10)], profile=True)
+#           vidToDna("original-videos/food.mp4", metrics=metrics)
+#           metrics.summary() --> frames, frames/sec, seconds in every stage, counters
+#           print(metrics.profileStats())
+#       Encoding stages:
+#           read - cap.read
+#           posterize - posterizing the frame
+#           changes - finding changed pixels and runs
+#           emit - making the bases
+#           write - writing the strand
+#       Decoding stages:
+#           tokens - reading the strand's tokens and colors
+#           frame - putting the frame together, mutations included
+#           write - vid.write (MJPG compression)
+#       Counters: runTokens, literalTokens, bases, changedPixels, pixels
+#       Hooks are called after every frame with (metrics, frame number, that frame's stats)
+#       Nothing is timed or counted when vidToDna/decodeDNA get no Metrics
+#       With workers the encoding stages are timed in the worker processes, so they add up
+#       to CPU time and can be more than the wall time (the profiler only sees the main process)
+###
+
+import cProfile
+import io
+import pstats
+import time
+
+
+stageNames = ['read', 'posterize', 'changes', 'emit', 'tokens', 'frame', 'write']
+
+
+class Metrics:
+    def __init__(self, hooks=(), profile=False):
+        self.hooks = list(hooks)
+        self.totals = {}
+        self.frames = 0
+        self.seconds = 0.0
+        self.started = None
+        self.profiler = cProfile.Profile() if profile else None
+
+    # the wall time of a run, and the profiler if there is one
+    def start(self):
+        self.started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.seconds += time.perf_counter() - self.started
+
+    def add(self, name, value):
+        self.totals[name] = self.totals.get(name, 0) + value
+
+    def frame(self, frameNumber, stats):
+        for name, value in stats.items():
+            self.add(name, value)
+        self.frames += 1
+        for hook in self.hooks:
+            hook(self, frameNumber, stats)
+
+    def framesPerSec(self):
+        elapsed = self.seconds + (time.perf_counter() - self.started if self.started is not None else 0)
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        stages = {name: self.totals[name] for name in stageNames if name in self.totals}
+        counters = {name: value for name, value in self.totals.items() if name not in stageNames}
+        summary = {
+            'frames': self.frames,
+            'seconds': self.seconds,
+            'framesPerSec': self.frames / self.seconds if self.seconds > 0 else 0.0,
+            'stages': stages,
+            'counters': counters,
+        }
+        if counters.get('pixels'):
+            summary['changedPixelRatio'] = counters.get('changedPixels', 0) / counters['pixels']
+        if self.seconds > 0 and 'bases' in counters:
+            summary['basesPerSec'] = counters['bases'] / self.seconds
+        if stages:
+            summary['slowestStage'] = max(stages, key=stages.get)
+        return summary
+
+    def profileStats(self, sort='cumulative', limit=30):
+        if self.profiler is None:
+            return ''
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+# Hooks
+# prints progress every so many frames, like vidToDna and decodeDNA do without metrics
+def printProgress(every=10):
+    def hook(metrics, frameNumber, stats):
+        if (frameNumber + 1) % every == 0:
+            print(f"Frame {frameNumber + 1} done ({metrics.framesPerSec():.1f} frames/sec)")
+    return hook
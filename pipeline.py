@@ -0,0 +1,90 @@
+###
+# Pipeline:
+#       Lets reading, coding and writing overlap, each in its own thread
+#       The stages talk through queues of at most depth items, so memory stays bounded
+#       OpenCV (cap.read, vid.write) and file writes let go of the GIL while they work,
+#       so they run at the same time as the numpy work of encoding/decoding
+#           threaded(items, depth) - runs a generator in its own thread
+#           ThreadedWriter(write, depth) - calls write in its own thread
+#       Errors in a thread come back out in the thread using it
+###
+
+import queue
+import threading
+
+
+# the generator stops at the end of the items, or when the one using it stops
+def threaded(items, depth):
+    results = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(result):
+        while not stop.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None, False)):
+                    return
+            put((None, None, True))
+        except BaseException as error:
+            put((None, error, True))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error, finished = results.get()
+            if error is not None:
+                raise error
+            if finished:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ThreadedWriter:
+    def __init__(self, write, depth):
+        self.write = write
+        self.items = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self):
+        while True:
+            item = self.items.get()
+            if item is None:
+                return
+            # after an error the rest is thrown away, so put never waits forever
+            if self.error is None:
+                try:
+                    self.write(item)
+                except BaseException as error:
+                    self.error = error
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.items.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
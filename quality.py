@@ -0,0 +1,162 @@
+###
+# Quality:
+#       How close a decode is to the original video, frame by frame
+#       The original and the decode are read together, one frame of each at a time, so memory does not
+#       depend on the length of the video and no decoded video has to be kept around
+#       The decode is either a strand (.txt or .dna, decoded on the fly with any mutation, see iterFrames)
+#       or a decoded video (like decoded-videos/*.avi, which also has the MJPG compression in it)
+#       For every frame:
+#           psnr - peak signal to noise ratio in dB (inf if the frames are the same, null in the JSON output)
+#           ssim - structural similarity (Gaussian window, every color on its own, then averaged)
+#           changedPixelRatio - how many pixels differ from the original in any color
+#       posterized compares against the original posterized like the strand was, to see only
+#       what the mutation changed (strands only)
+#
+#       python quality.py original-videos/food.mp4 dna-encodings/food.mp4_none_encoding.txt --mutation rip --seed 1
+#       python quality.py original-videos/food.mp4 decoded-videos/food_none_cancer.avi --output cancer-quality.json
+###
+
+import argparse
+import json
+import math
+import cv2
+import numpy as np
+from decoding import iterFrames, readHeader
+from encoding import posterizedFrame
+from strand import openStrand
+
+
+# from the SSIM paper (Wang et al. 2004), for 8 bit colors
+ssimC1 = (0.01 * 255) ** 2
+ssimC2 = (0.03 * 255) ** 2
+
+
+def psnr(meanSquaredError):
+    return 10 * math.log10(255 ** 2 / meanSquaredError) if meanSquaredError > 0 else math.inf
+
+
+def ssim(frame, other):
+    x = frame.astype(np.float32)
+    y = other.astype(np.float32)
+
+    def blur(image):
+        return cv2.GaussianBlur(image, (11, 11), 1.5)
+
+    meanX, meanY = blur(x), blur(y)
+    varianceX = blur(x * x) - meanX * meanX
+    varianceY = blur(y * y) - meanY * meanY
+    covariance = blur(x * y) - meanX * meanY
+    similarity = ((2 * meanX * meanY + ssimC1) * (2 * covariance + ssimC2)
+                  / ((meanX * meanX + meanY * meanY + ssimC1) * (varianceX + varianceY + ssimC2)))
+    return float(similarity.mean())
+
+
+def frameQuality(original, decoded):
+    difference = cv2.absdiff(original, decoded)
+    meanSquaredError = float(np.mean(np.square(difference, dtype=np.float32)))
+    blue, green, red = cv2.split(difference)
+    return {'mse': meanSquaredError, 'psnr': psnr(meanSquaredError), 'ssim': ssim(original, decoded),
+            'changedPixelRatio': float(np.count_nonzero(blue | green | red)) / difference.shape[0] / difference.shape[1]}
+
+
+def isStrand(path):
+    return path.endswith('.txt') or path.endswith('.dna')
+
+
+def readFrames(path):
+    cap = cv2.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+    finally:
+        cap.release()
+
+
+# returns {'frames': one quality dict per frame, 'summary': ...}
+# the summary's psnr is from the mean squared error of the whole video (so a few same frames don't make it inf),
+# the other numbers are means and worst frames
+# mutation, seed and workers are for strands, see iterFrames
+def qualityReport(originalPath, decodedPath, mutation='none', seed=None, workers=1, posterized=False):
+    posterization = None
+    if isStrand(decodedPath):
+        if posterized:
+            with openStrand(decodedPath) as strand:
+                posterization = readHeader(strand).posterization
+        decodedFrames = iterFrames(decodedPath, mutation, seed=seed, workers=workers, copy=False)
+    elif posterized:
+        raise ValueError('posterized needs a strand, a decoded video does not say how it was posterized')
+    else:
+        decodedFrames = readFrames(decodedPath)
+
+    frames = []
+    originalFrames = readFrames(originalPath)
+    frameNumber = 0
+    while True:
+        original, decoded = next(originalFrames, None), next(decodedFrames, None)
+        if original is None or decoded is None:
+            break
+        if original.shape != decoded.shape:
+            raise ValueError(f'frame {frameNumber} is {decoded.shape[1]}x{decoded.shape[0]} in the decode '
+                             f'but {original.shape[1]}x{original.shape[0]} in the original')
+        if posterization is not None:
+            original = posterizedFrame(original, posterization)
+        frames.append({'frame': frameNumber, **frameQuality(original, decoded)})
+        frameNumber += 1
+    # frames only in one of them (a decode cut short, or a mutation that made more frames)
+    extraOriginal = (original is not None) + sum(1 for frame in originalFrames)
+    extraDecoded = (decoded is not None) + sum(1 for frame in decodedFrames)
+
+    summary = {'frames': len(frames), 'framesOnlyInOriginal': extraOriginal, 'framesOnlyInDecode': extraDecoded}
+    if frames:
+        meanSquaredError = float(np.mean([quality['mse'] for quality in frames]))
+        worst = min(frames, key=lambda quality: quality['ssim'])
+        summary.update(
+            psnr=psnr(meanSquaredError),
+            minPsnr=min(quality['psnr'] for quality in frames),
+            ssim=float(np.mean([quality['ssim'] for quality in frames])),
+            minSsim=worst['ssim'],
+            worstFrame=worst['frame'],
+            changedPixelRatio=float(np.mean([quality['changedPixelRatio'] for quality in frames])),
+        )
+    return {'frames': frames, 'summary': summary}
+
+
+# JSON has no inf, so a psnr of same frames is written as null
+def jsonReport(report):
+    def finite(quality):
+        return {name: None if isinstance(value, float) and math.isinf(value) else value for name, value in quality.items()}
+    return {'frames': [finite(quality) for quality in report['frames']], 'summary': finite(report['summary'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PSNR, SSIM and changed pixels of a decode against the original video')
+    parser.add_argument('original')
+    parser.add_argument('decoded', help='a strand (.txt or .dna) or a decoded video')
+    parser.add_argument('--output', help='JSON file for the per-frame series and the summary')
+    parser.add_argument('--mutation', default='none')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--posterized', action='store_true', help='compare against the posterized original')
+    args = parser.parse_args()
+
+    report = qualityReport(args.original, args.decoded, args.mutation, args.seed, args.workers, args.posterized)
+    summary = report['summary']
+    print(f"{summary['frames']} frames compared")
+    if summary['frames']:
+        print(f"PSNR {summary['psnr']:.2f} dB (worst frame {summary['minPsnr']:.2f} dB), "
+              f"SSIM {summary['ssim']:.4f} (worst {summary['minSsim']:.4f}, frame {summary['worstFrame']}), "
+              f"{summary['changedPixelRatio']:.1%} of pixels changed")
+    if summary['framesOnlyInOriginal'] or summary['framesOnlyInDecode']:
+        print(f"{summary['framesOnlyInOriginal']} frames only in the original, "
+              f"{summary['framesOnlyInDecode']} only in the decode")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(jsonReport(report), f, indent=2)
+        print(f'Report in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+###
+# Round trip:
+#       Encodes synthetic clips (see benchmark.py) with every posterization and format option, then
+#       checks that iterFrames gives back exactly the posterized clip, frame for frame
+#       (high only keeps the first color, the decoder puts it in all three, see posterizedFrame in encoding.py)
+#       Also decodes from the middle of strands with keyframes, and with worker processes
+#       The keyframe clip is made to catch a frame ending in runs right before a keyframe
+#       whose colors start with GAA (bases that also read as empty runs)
+#
+#       python roundtrip.py                      - every option set, prints the ones that fail
+#       python roundtrip.py --workers 2 --frames 30
+###
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import cv2
+import numpy as np
+from benchmark import makeClip
+from decoding import iterFrames
+from encoding import posterizedFrame, vidToDna
+
+
+clipKinds = ['motion', 'bw', 'noisy']
+posterizations = ['high', 'med', 'low', 'none']
+optionSets = [
+    {},
+    {'longRuns': True},
+    {'packed': True},
+    {'keyframeInterval': 5},
+    {'tileSize': 8},
+    {'entropy': True},
+    {'keyframeInterval': 4, 'tileSize': 8, 'entropy': True, 'packed': True},
+]
+
+
+# random colors on top, a still bottom half (so every frame ends in runs), and a first pixel of 192
+# in the first color (GAAA with no posterization), with a keyframe every 3 frames
+def makeKeyframeClip(path, width, height, frameCount, fps, seed):
+    rng = np.random.default_rng(seed)
+    vid = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'FFV1'), fps, (width, height))
+    for k in range(frameCount):
+        frame = rng.integers(0, 256, (height, width, 3)).astype(np.uint8)
+        frame[height // 2:] = 50
+        frame[0, 0] = (192, 10, 10)
+        vid.write(frame)
+    vid.release()
+    return path
+
+
+def readClip(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def sameFrames(frames, expected):
+    return len(frames) == len(expected) and all(np.array_equal(frame, other) for frame, other in zip(frames, expected))
+
+
+# returns the failures as (clip, posterization, options, what was decoded)
+def roundTrip(width=64, height=48, frameCount=12, fps=24, workDir='roundtrip-work', workers=1, seed=0):
+    os.makedirs(workDir, exist_ok=True)
+    clips = [(makeClip(os.path.join(workDir, f'{kind}.avi'), kind, width, height, frameCount, fps, seed), optionSets)
+             for kind in clipKinds]
+    keyframeClip = makeKeyframeClip(os.path.join(workDir, 'keyframes.avi'), width, height, frameCount, fps, seed)
+    clips.append((keyframeClip, [{'keyframeInterval': 3}, {'keyframeInterval': 3, 'longRuns': True}]))
+
+    failures = []
+    for clipPath, clipOptions in clips:
+        source = readClip(clipPath)
+        for posterization in posterizations:
+            expected = [posterizedFrame(frame, posterization) for frame in source]
+            for options in clipOptions:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    strandPath = vidToDna(clipPath, posterization, outputDir=workDir, **options)
+                decodes = {'all': (list(iterFrames(strandPath, workers=workers)), expected)}
+                if options.get('keyframeInterval'):
+                    start = frameCount // 2
+                    decodes['from frame %d' % start] = (list(iterFrames(strandPath, start=start, workers=workers)),
+                                                        expected[start:])
+                for name, (frames, wanted) in decodes.items():
+                    if not sameFrames(frames, wanted):
+                        failures.append((os.path.basename(clipPath), posterization, options, name))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks every strand format decodes back to the posterized video')
+    parser.add_argument('--work-dir', default='roundtrip-work')
+    parser.add_argument('--width', type=int, default=64)
+    parser.add_argument('--height', type=int, default=48)
+    parser.add_argument('--frames', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=1, help='decode with that many processes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    failures = roundTrip(args.width, args.height, args.frames, workDir=args.work_dir, workers=args.workers,
+                         seed=args.seed)
+    for clip, posterization, options, name in failures:
+        print(f'{clip} {posterization} {options}: {name} differs from the posterized clip')
+    if failures:
+        sys.exit(1)
+    print('Every strand decodes back to the posterized clip')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+###
+# Strand files:
+#       Reads and writes the strands made by encoding.py without holding the whole strand
+#       Strands are handled as base codes (A = 0, T = 1, C = 2, G = 3)
+#       Two kinds of files:
+#           text (.txt) - one letter per base
+#           packed (.dna) - 4 bases per byte, after a small header with the base count,
+#                           posterization, fps and frame size
+#       Only the part of the strand being decoded is kept in memory, so memory
+#       depends on the frame size and not on the length of the video
+#       Strands with tiles (version 3) start every frame with a tile map, see tileOrder
+#       Strands with a color table (version 4) write literal colors with a code per color, see canonicalCodes
+#       Strands get an index file next to them (strand path + .idx) with the position of every frame,
+#       so decoding can start from any keyframe, and worker processes can read frames on their own
+###
+
+import mmap
+import os
+import shutil
+import struct
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+
+
+# letters --> codes with one lookup over a chunk of the strand
+baseCodes = np.zeros(256, dtype=np.uint8)
+for code, base in enumerate(b'ATCG'):
+    baseCodes[base] = code
+codeLetters = bytes.maketrans(bytes(range(4)), b'ATCG')
+
+# bases read from the file at a time
+chunkSize = 1 << 22
+
+# packed header: magic, number of bases, posterization (code of the strand's first base), fps, width, height
+packedMagic = b'DNAP'
+packedHeader = struct.Struct('<4sQBHHH')
+
+# byte --> its 4 codes, first base in the high bits
+unpackTable = np.array([[(byte >> shift) & 3 for shift in (6, 4, 2, 0)] for byte in range(256)], dtype=np.uint8)
+
+
+def packCodes(codes):
+    codes = codes.reshape(-1, 4)
+    return (codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2) | codes[:, 3]
+
+
+# base codes --> num
+def fromCodes(codes):
+    num = 0
+    for code in codes:
+        num = num * 4 + int(code)
+    return num
+
+
+# Header
+#   legacy (17 bases): posterization (1), fps (4), width (6), height (6)
+#   versioned: an fps of AAAA marks a versioned header, the real fps comes after the version
+#       posterization (1), AAAA, version (2), fps (4), width (6), height (6)
+#       version 1: keyframe interval (8), every interval-th frame is written out whole (0 = first frame only)
+#       version 2: same fields, frames can use runs of any length and a token for the rest of the frame unchanged
+#       version 3: version 2 and a tile size (4), frames after a keyframe start with a tile map
+#       version 4: version 3 and a color table: number of colors (6), length of the escape code (2),
+#           then for every color the length of its code (2) and its colors as in a literal
+#           literals after a keyframe are C + the color's code, or C + the escape code + the colors
+posterizations = ['high', 'med', 'low', 'none']
+literalWidths = [1, 6, 9, 12]
+keyframeVersion = 1
+longRunVersion = 2
+tileVersion = 3
+entropyVersion = 4
+formatVersion = 4
+legacyHeaderSize = 17
+versionedHeaderSize = 31
+tiledHeaderSize = 35
+entropyHeaderSize = 43
+# the largest keyframe interval and tile size the header fields hold
+maxKeyframeInterval = 4 ** 8 - 1
+maxTileSize = 4 ** 4 - 1
+Header = namedtuple('Header', ['posterization', 'fps', 'width', 'height', 'version', 'keyframeInterval', 'tileSize',
+                               'colorTable', 'size'])
+# the code lengths and literal colors as bytes (so a table can be a cache key), the escape code is symbol 0
+ColorTable = namedtuple('ColorTable', ['escapeLength', 'lengths', 'colors'])
+
+
+# bases in the header, from its first entropyHeaderSize bases
+def headerSize(codes):
+    if fromCodes(codes[1:5]) != 0:
+        return legacyHeaderSize
+    version = fromCodes(codes[5:7])
+    if version < tileVersion:
+        return versionedHeaderSize
+    if version < entropyVersion:
+        return tiledHeaderSize
+    return entropyHeaderSize + fromCodes(codes[35:41]) * (2 + literalWidths[codes[0]])
+
+
+# without withTable only the first tiledHeaderSize bases are needed (the color table is left out)
+def parseHeader(codes, withTable=True):
+    posterization = posterizations[codes[0]]
+    fps = fromCodes(codes[1:5])
+    if fps != 0:
+        return Header(posterization, fps, fromCodes(codes[5:11]), fromCodes(codes[11:17]), 0, 0, 0, None, legacyHeaderSize)
+    version = fromCodes(codes[5:7])
+    if version > formatVersion:
+        raise ValueError(f'strand format version {version} is newer than this decoder ({formatVersion})')
+    tileSize, colorTable, size = 0, None, versionedHeaderSize
+    if version >= tileVersion:
+        tileSize, size = fromCodes(codes[31:35]), tiledHeaderSize
+    if version >= entropyVersion and withTable:
+        width = literalWidths[codes[0]]
+        count = fromCodes(codes[35:41])
+        size = entropyHeaderSize + count * (2 + width)
+        entries = np.asarray(codes[entropyHeaderSize:size], dtype=np.uint8).reshape(count, 2 + width)
+        lengths = entries[:, 0] * 4 + entries[:, 1]
+        colorTable = ColorTable(fromCodes(codes[41:43]), lengths.tobytes(), np.ascontiguousarray(entries[:, 2:]).tobytes())
+    return Header(posterization, fromCodes(codes[7:11]), fromCodes(codes[11:17]), fromCodes(codes[17:23]),
+                  version, fromCodes(codes[23:31]), tileSize, colorTable, size)
+
+
+def isKeyframe(header, frameNumber):
+    if header.keyframeInterval == 0:
+        return frameNumber == 0
+    return frameNumber % header.keyframeInterval == 0
+
+
+# Color codes
+#   every color gets a code of 1 to maxCodeLength bases, the most used colors the shortest (quaternary Huffman)
+#   only the lengths are stored, the codes are given out in order of length (then symbol): canonical codes
+#   so every code of length l is read with one lookup of the next maxCodeLength bases
+maxCodeLength = 8
+
+def canonicalCodes(lengths):
+    values = [0] * len(lengths)
+    code, previous = 0, 0
+    for symbol in sorted(range(len(lengths)), key=lambda symbol: (lengths[symbol], symbol)):
+        code *= 4 ** (int(lengths[symbol]) - previous)
+        values[symbol] = code
+        code += 1
+        previous = int(lengths[symbol])
+    return values
+
+
+# Tiles
+#   the frame is cut into tileSize x tileSize tiles (smaller at the right and bottom edges)
+#   a tile map starts every frame after a keyframe, one base per tile in row order:
+#       G - the tile is the same as in the last frame
+#       C - the tile changed
+#       T - every tile from here on is the same (the map ends there)
+#   then the pixels of the changed tiles, tile by tile (rows inside a tile), as version 2 tokens
+# returns the pixels in tile order and the tile of each of them
+@lru_cache(maxsize=8)
+def tileOrder(width, height, tileSize):
+    rows, cols = np.divmod(np.arange(width * height), width)
+    tilesAcross = -(-width // tileSize)
+    tiles = (rows // tileSize) * tilesAcross + cols // tileSize
+    order = np.argsort(tiles, kind='stable')
+    return order, tiles[order]
+
+
+def tileCount(width, height, tileSize):
+    return -(-width // tileSize) * -(-height // tileSize)
+
+
+# Frame index: one line per frame, its frame number and the position of its first base
+def indexPath(path):
+    return path + '.idx'
+
+
+def writeIndex(path, frames):
+    with open(indexPath(path), 'w') as f:
+        for frameNumber, position in frames:
+            f.write(f'{frameNumber} {position}\n')
+
+
+# returns the frames as (frame number, position) pairs, empty if the strand has no index
+def readIndex(path):
+    if not os.path.exists(indexPath(path)):
+        return []
+    with open(indexPath(path)) as f:
+        return [tuple(int(num) for num in line.split()) for line in f if line.strip()]
+
+
+# the keyframe closest before frame n, (0, None) if there is none to jump to
+def nearestKeyframe(header, index, n):
+    best = (0, None)
+    for frameNumber, position in index:
+        if isKeyframe(header, frameNumber) and frameNumber <= n and frameNumber >= best[0]:
+            best = (frameNumber, position)
+    return best
+
+
+# Reading
+class StrandReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        # one base per byte
+        self.length = os.fstat(self.file.fileno()).st_size
+        # codes of the strand from position start on
+        self.start = 0
+        self.buffer = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    # codes of the bases from start to start + size
+    # also tells if the window reaches the end of the strand
+    # everything before start is dropped from the buffer
+    def window(self, start, size):
+        end = min(start + size, self.length)
+        bufferEnd = self.start + len(self.buffer)
+        if start < self.start or start > bufferEnd:
+            # jumping somewhere else in the strand
+            self.start = start
+            self.buffer = np.empty(0, dtype=np.uint8)
+            bufferEnd = start
+        if end > bufferEnd:
+            self.file.seek(bufferEnd)
+            chunk = self.file.read(max(end - bufferEnd, chunkSize))
+            kept = self.buffer[start - self.start:]
+            self.buffer = np.concatenate((kept, baseCodes[np.frombuffer(chunk, dtype=np.uint8)]))
+            self.start = start
+        return self.buffer[start - self.start:end - self.start], end >= self.length
+
+
+# the packed file is mapped into memory and viewed as an array without copying,
+# windows are unpacked from it as the decoder asks for them
+class PackedStrandReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.length, self.posterization, self.fps, self.width, self.height = packedHeader.unpack_from(self.map)
+        if magic != packedMagic:
+            raise ValueError(f'{path} is not a packed strand')
+        self.packed = np.frombuffer(self.map, dtype=np.uint8, offset=packedHeader.size)
+        # pages before this byte have been given back
+        self.released = 0
+
+    def __len__(self):
+        return self.length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        del self.packed
+        self.map.close()
+        self.file.close()
+
+    def window(self, start, size):
+        end = min(start + size, self.length)
+        codes = unpackTable[self.packed[start // 4:(end + 3) // 4]].ravel()
+        self.release(packedHeader.size + start // 4)
+        return codes[start % 4:start % 4 + end - start], end >= self.length
+
+    # the decoder never goes back much, so pages far behind it are dropped
+    # from memory (they are read from the file again if it does)
+    def release(self, offset):
+        if not hasattr(mmap, 'MADV_DONTNEED') or offset - self.released < chunkSize:
+            return
+        offset -= offset % mmap.PAGESIZE
+        self.map.madvise(mmap.MADV_DONTNEED, self.released, offset - self.released)
+        self.released = offset
+
+
+# codes already in memory (a piece of a strand), read like a strand from position 0
+class CodesReader:
+    def __init__(self, codes):
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def window(self, start, size):
+        end = min(start + size, len(self.codes))
+        return self.codes[start:end], end >= len(self.codes)
+
+
+def isPacked(path):
+    with open(path, 'rb') as f:
+        return f.read(len(packedMagic)) == packedMagic
+
+
+def openStrand(path):
+    if isPacked(path):
+        return PackedStrandReader(path)
+    return StrandReader(path)
+
+
+# Writing
+class StrandWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, codes):
+        self.file.write(codes.tobytes().translate(codeLetters))
+
+    def close(self):
+        self.file.close()
+
+
+# bases are packed 4 at a time, leftovers wait for the next write
+# the header is filled in on close, from the strand's own header
+class PackedStrandWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(bytes(packedHeader.size))
+        self.length = 0
+        self.header = np.empty(0, dtype=np.uint8)
+        self.leftover = np.empty(0, dtype=np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, codes):
+        if len(self.header) < tiledHeaderSize:
+            self.header = np.concatenate((self.header, codes[:tiledHeaderSize - len(self.header)]))
+        self.length += len(codes)
+        codes = np.concatenate((self.leftover, codes))
+        whole = len(codes) - len(codes) % 4
+        self.file.write(packCodes(codes[:whole]).tobytes())
+        self.leftover = codes[whole:]
+
+    def close(self):
+        if len(self.leftover):
+            self.file.write(packCodes(np.concatenate((self.leftover, np.zeros(4 - len(self.leftover), dtype=np.uint8)))).tobytes())
+        codes = np.zeros(tiledHeaderSize, dtype=np.uint8)
+        codes[:len(self.header)] = self.header
+        header = parseHeader(codes, withTable=False)
+        self.file.seek(0)
+        self.file.write(packedHeader.pack(packedMagic, self.length, codes[0], header.fps, header.width, header.height))
+        self.file.close()
+
+
+def strandWriter(path, packed):
+    if packed:
+        return PackedStrandWriter(path)
+    return StrandWriter(path)
+
+
+# Converting between the two, a chunk at a time
+# positions are counted in bases in both, so the keyframe index carries over as is
+def copyStrand(reader, writer):
+    i = 0
+    while i < len(reader):
+        codes, atEnd = reader.window(i, chunkSize)
+        writer.write(codes)
+        i += len(codes)
+
+
+def copyIndex(fromPath, toPath):
+    if os.path.exists(indexPath(fromPath)):
+        shutil.copyfile(indexPath(fromPath), indexPath(toPath))
+
+
+def textToPacked(textPath, packedPath):
+    with StrandReader(textPath) as reader, PackedStrandWriter(packedPath) as writer:
+        copyStrand(reader, writer)
+    copyIndex(textPath, packedPath)
+    return packedPath
+
+
+def packedToText(packedPath, textPath):
+    with PackedStrandReader(packedPath) as reader, StrandWriter(textPath) as writer:
+        copyStrand(reader, writer)
+    copyIndex(packedPath, textPath)
+    return textPath